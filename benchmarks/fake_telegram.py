@@ -0,0 +1,95 @@
+"""Fake Telegram Bot API transport, so the real Bot and handlers run without any network."""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Answers Bot API calls locally after a fixed delay, counting calls per method.
+
+    Messages sent get increasing IDs; photos get a unique file_id so the poster
+    file_id cache behaves as with the real API.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout: Any = None, write_timeout: Any = None, connect_timeout: Any = None,
+                         pool_timeout: Any = None) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, parameters)}).encode()
+
+    def _result(self, api_method: str, parameters: Dict[str, Any]) -> Any:
+        if api_method == 'getMe':
+            return dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False,
+                        supports_inline_queries=True)
+        if api_method.startswith(('send', 'edit')):
+            message = {'message_id': parameters.get('message_id') or next(self._message_ids),
+                       'date': int(time.time()), 'from': BOT_USER,
+                       'chat': {'id': parameters.get('chat_id', 0), 'type': 'private'}}
+            if api_method == 'sendPhoto':
+                file_id = f'photo{message["message_id"]}'
+                message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 342, 'height': 513}]
+                message['caption'] = parameters.get('caption', '')
+            else:
+                message['text'] = parameters.get('text', '')
+            return message
+        if api_method == 'getUpdates':
+            return []
+        return True
+
+
+class UpdateFactory:
+    """Builds the updates a private chat user would send, bound to the application's bot."""
+
+    def __init__(self, application: Application):
+        self.application = application
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, user_id: int, text: str, from_bot: bool = False) -> Dict[str, Any]:
+        user = BOT_USER if from_bot else {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+        return {'message_id': next(self._message_ids), 'date': int(time.time()), 'from': user,
+                'chat': {'id': user_id, 'type': 'private'}, 'text': text}
+
+    def command(self, user_id: int, text: str) -> Update:
+        """A message such as '/search inception'."""
+        message = self._message(user_id, text)
+        command_length = len(text.split(' ', 1)[0])
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': command_length}]
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message}, self.application.bot)
+
+    def button(self, user_id: int, data: str) -> Update:
+        """A tap on an inline keyboard button of one of the bot's messages."""
+        callback_query = {'id': str(next(self._update_ids)), 'chat_instance': str(user_id), 'data': data,
+                          'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+                          'message': self._message(user_id, '搜索结果', from_bot=True)}
+        return Update.de_json({'update_id': next(self._update_ids), 'callback_query': callback_query},
+                              self.application.bot)
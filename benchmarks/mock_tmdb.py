@@ -0,0 +1,207 @@
+"""
+Local stand-in for the TMDB API, serving recorded fixtures with injectable latency and faults.
+
+Run it on its own to point a development bot at it:
+
+    python -m benchmarks.mock_tmdb --port 8765 --tmdb-latency 80 --tmdb-error-rate 0.01
+    TMDB_BASE_URL=http://127.0.0.1:8765 TMDB_IMAGE_BASE_URL=http://127.0.0.1:8765 python main.py
+
+Refresh the fixtures from the live API with `--record` (needs TMDB_API_KEY).
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import re
+import zlib
+from collections import Counter
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from bot.webhook import HTTPServer, Request, Response
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# 最小的 JPEG 文件头，足够让海报缓存当作图片保存
+POSTER_BYTES = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xd9'
+
+# fixture name -> (TMDB path, params) used by --record
+RECORDED_REQUESTS = {
+    'search_movie': ('/search/movie', {'query': 'inception', 'language': 'zh-CN'}),
+    'search_tv': ('/search/tv', {'query': 'breaking bad', 'language': 'zh-CN'}),
+    'movie_details': ('/movie/27205', {'language': 'zh-CN'}),
+    'tv_details': ('/tv/1396', {'language': 'zh-CN'}),
+    'trending_movie': ('/trending/movie/week', {'language': 'zh-CN'}),
+    'trending_tv': ('/trending/tv/week', {'language': 'zh-CN'}),
+}
+
+DETAILS_PATH = re.compile(r'^/(movie|tv)/(\d+)$')
+TRENDING_PATH = re.compile(r'^/trending/(movie|tv|all)/(day|week)$')
+IMAGE_PATH = re.compile(r'^/(w\d+|original)/')
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> Dict[str, Any]:
+    """Load every fixture of RECORDED_REQUESTS from directory."""
+    fixtures = {}
+    for name in RECORDED_REQUESTS:
+        with open(os.path.join(directory, f'{name}.json'), encoding='utf-8') as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+class MockTMDB(HTTPServer):
+    """
+    HTTP server answering the TMDB endpoints the bot uses from fixtures.
+
+    Search results are derived from the query, so the same query always returns the same
+    IDs and different queries return different ones, like the real API. Every request
+    waits latency plus a uniform random jitter; error_rate of them fail with 500 and
+    rate_limit_rate with 429.
+    """
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 0, fixtures: Optional[Dict[str, Any]] = None,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, results_per_page: int = 20, seed: Optional[int] = None):
+        super().__init__(listen, port)
+        self.fixtures = fixtures or load_fixtures()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.results_per_page = results_per_page
+        self.stats: Counter = Counter()
+        self._random = random.Random(seed)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.listen}:{self.bound_port}"
+
+    async def _dispatch(self, request: Request) -> Response:
+        path, _, query_string = request[1].partition('?')
+        if path == '/_stats':
+            return HTTPStatus.OK, 'application/json', json.dumps(self.stats).encode()
+
+        self.stats['requests'] += 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            self.stats['rate_limited'] += 1
+            return HTTPStatus.TOO_MANY_REQUESTS, 'application/json', b'{"status_code":25}'
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats['errors'] += 1
+            return HTTPStatus.INTERNAL_SERVER_ERROR, 'application/json', b'{"status_code":11}'
+
+        if IMAGE_PATH.match(path):
+            self.stats['images'] += 1
+            return HTTPStatus.OK, 'image/jpeg', POSTER_BYTES
+        params = {name: values[0] for name, values in parse_qs(query_string).items()}
+        body = self._route(path, params)
+        if body is None:
+            self.stats['not_found'] += 1
+            return HTTPStatus.NOT_FOUND, 'application/json', b'{"status_code":34}'
+        return HTTPStatus.OK, 'application/json', json.dumps(body, ensure_ascii=False).encode()
+
+    def _route(self, path: str, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        match = DETAILS_PATH.match(path)
+        if match:
+            details = copy.deepcopy(self.fixtures[f'{match.group(1)}_details'])
+            details['id'] = int(match.group(2))
+            return details
+        if path in ('/search/movie', '/search/tv'):
+            return self._page(self._search(path.rsplit('/', 1)[1], params.get('query', '')))
+        if path == '/search/multi':
+            query = params.get('query', '')
+            results = [dict(item, media_type='movie') for item in self._search('movie', query)]
+            results += [dict(item, media_type='tv') for item in self._search('tv', query)]
+            return self._page(results[:self.results_per_page])
+        match = TRENDING_PATH.match(path)
+        if match:
+            media_type = match.group(1)
+            if media_type == 'all':
+                return self._page(self.fixtures['trending_movie']['results'] + self.fixtures['trending_tv']['results'])
+            return self.fixtures[f'trending_{media_type}']
+        if path in ('/movie/changes', '/tv/changes'):
+            return {'results': [], 'page': 1, 'total_pages': 1, 'total_results': 0}
+        return None
+
+    def _search(self, media_type: str, query: str) -> List[Dict[str, Any]]:
+        # 用查询词决定 ID 段，同一查询结果稳定，不同查询互不重叠
+        base = (zlib.crc32(query.encode()) % 100000 + 1) * 1000
+        templates = self.fixtures[f'search_{media_type}']['results']
+        title_field = 'title' if media_type == 'movie' else 'name'
+        results = []
+        for index in range(self.results_per_page):
+            item = dict(templates[index % len(templates)])
+            item['id'] = base + index
+            item[title_field] = f"{item[title_field]} {query}".strip()
+            item['popularity'] = float(self.results_per_page - index)
+            results.append(item)
+        return results
+
+    @staticmethod
+    def _page(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {'page': 1, 'results': results, 'total_pages': 1, 'total_results': len(results)}
+
+
+def record_fixtures(api_key: str, directory: str = FIXTURES_DIR) -> None:
+    """Fetch the responses in RECORDED_REQUESTS from the live API and save them as fixtures."""
+    import httpx
+
+    with httpx.Client(base_url='https://api.themoviedb.org/3',
+                      headers={'Authorization': f'Bearer {api_key}', 'accept': 'application/json'}) as client:
+        for name, (path, params) in RECORDED_REQUESTS.items():
+            response = client.get(path, params=params)
+            response.raise_for_status()
+            with open(os.path.join(directory, f'{name}.json'), 'w', encoding='utf-8') as f:
+                json.dump(response.json(), f, ensure_ascii=False, indent=1)
+            print(f"recorded {name} from {path}")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Latency and fault options, named like those of benchmarks.run (latencies in milliseconds)."""
+    parser.add_argument('--tmdb-latency', type=float, default=50, help='base TMDB latency in ms')
+    parser.add_argument('--tmdb-jitter', type=float, default=50, help='extra uniform random latency in ms')
+    parser.add_argument('--tmdb-error-rate', type=float, default=0.0, help='fraction of 500 responses')
+    parser.add_argument('--tmdb-429-rate', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='directory of recorded responses')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def from_arguments(args: argparse.Namespace, listen: str = '127.0.0.1', port: int = 0) -> MockTMDB:
+    return MockTMDB(listen, port, load_fixtures(args.fixtures), latency=args.tmdb_latency / 1000,
+                    jitter=args.tmdb_jitter / 1000, error_rate=args.tmdb_error_rate,
+                    rate_limit_rate=args.tmdb_429_rate, seed=args.seed)
+
+
+async def serve(server: MockTMDB) -> None:
+    await server.start()
+    # 基准测试脚本从第一行输出读取地址
+    print(server.base_url, flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--record', action='store_true', help='re-record the fixtures from the live API and exit')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.record:
+        record_fixtures(os.environ['TMDB_API_KEY'], args.fixtures)
+        return
+    try:
+        asyncio.run(serve(from_arguments(args, args.listen, args.port)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
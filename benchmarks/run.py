@@ -0,0 +1,319 @@
+"""
+Offline load test of the bot: replays synthetic user traffic through the real handlers.
+
+TMDB is replaced by benchmarks.mock_tmdb running in a separate process and Telegram by
+an in-process fake transport, so nothing leaves the machine. The database, poster cache
+and search index live in a temporary directory that is removed afterwards.
+
+    python -m benchmarks.run --updates 5000 --users 100 --subscribers 2000
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --baseline before.json   # exits 1 on a regression
+
+Settings from config.py can be tuned through the environment as usual, e.g.
+MAX_CONCURRENT_UPDATES=32 python -m benchmarks.run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'search=4,details=3,page=1,back=1,add=1,watchlist=2,trending=1'
+TITLES = ['inception', 'matrix', 'interstellar', 'breaking bad', 'spirited away', 'dune', 'alien', 'friends',
+          'the office', 'godfather', 'parasite', 'sherlock', 'avatar', 'joker', 'titanic', 'dark']
+
+# Actions with fewer measured updates are only compared as part of 'all'
+MIN_COMPARED_SAMPLES = 200
+
+logger = logging.getLogger('benchmarks')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000, help='updates to measure')
+    parser.add_argument('--warmup', type=int, default=200, help='updates sent before measuring')
+    parser.add_argument('--users', type=int, default=50, help='simulated users sending updates concurrently')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='relative weights of the actions')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='distinct search queries, picked with a Zipf-like popularity')
+    parser.add_argument('--subscribers', type=int, default=1000, help='recipients of the weekly broadcast, 0 skips it')
+    parser.add_argument('--broadcast-rate', type=float, default=1000,
+                        help='BROADCAST_RATE_LIMIT for the run, so the bot rather than the limit is measured')
+    parser.add_argument('--telegram-latency', type=float, default=20, help='Bot API latency in ms')
+    parser.add_argument('--tmdb-latency', type=float, default=50, help='base TMDB latency in ms')
+    parser.add_argument('--tmdb-jitter', type=float, default=50, help='extra uniform random TMDB latency in ms')
+    parser.add_argument('--tmdb-error-rate', type=float, default=0.0, help='fraction of TMDB 500 responses')
+    parser.add_argument('--tmdb-429-rate', type=float, default=0.0, help='fraction of TMDB 429 responses')
+    parser.add_argument('--fixtures', default=None, help='directory of recorded TMDB responses')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative slowdown against the baseline reported as a regression')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args()
+
+
+def start_mock_tmdb(args: argparse.Namespace) -> subprocess.Popen:
+    """Start the TMDB stand-in in its own process, so serving it does not slow down the bot."""
+    command = [sys.executable, '-m', 'benchmarks.mock_tmdb', '--port', '0',
+               '--tmdb-latency', str(args.tmdb_latency), '--tmdb-jitter', str(args.tmdb_jitter),
+               '--tmdb-error-rate', str(args.tmdb_error_rate), '--tmdb-429-rate', str(args.tmdb_429_rate),
+               '--seed', str(args.seed)]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    return subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+
+
+def configure_environment(args: argparse.Namespace, workdir: str, tmdb_url: str) -> None:
+    """Point the bot at the stand-ins and the temporary directory before config.py is imported."""
+    database_url = f"sqlite:///{os.path.join(workdir, 'bot.db')}"
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'TMDB_API_KEY': 'benchmark',
+        'TMDB_BASE_URL': tmdb_url,
+        'TMDB_IMAGE_BASE_URL': tmdb_url,
+        'DATABASE_URL': database_url,
+        'ASYNC_DATABASE_URL': database_url.replace('sqlite://', 'sqlite+aiosqlite://', 1),
+        'POSTER_CACHE_DIR': os.path.join(workdir, 'posters'),
+        'SEARCH_INDEX_PATH': os.path.join(workdir, 'search_index.db'),
+        'BROADCAST_RATE_LIMIT': str(args.broadcast_rate),
+        'BOT_MODE': 'polling',
+    })
+    if os.environ.get('CACHE_DB_PATH'):
+        os.environ['CACHE_DB_PATH'] = os.path.join(workdir, 'cache.db')
+    os.environ.setdefault('METRICS_PORT', '0')
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        mix[action.strip()] = float(weight)
+    return mix
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of latencies in seconds, in milliseconds."""
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    values = sorted(latencies)
+
+    def at(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {'p50': at(0.5), 'p95': at(0.95), 'p99': at(0.99), 'max': values[-1] * 1000}
+
+
+class TrafficReplay:
+    """
+    Closed-loop load: each simulated user sends its next update as soon as the previous one
+    has been handled, through the application's update processor like polled updates.
+    """
+
+    def __init__(self, application: Any, args: argparse.Namespace):
+        from benchmarks.fake_telegram import UpdateFactory
+        from bot.search_snapshots import search_snapshots
+
+        self.application = application
+        self.updates = UpdateFactory(application)
+        self.snapshots = search_snapshots
+        self.random = random.Random(args.seed)
+        self.mix = parse_mix(args.mix)
+        self.queries = [TITLES[n % len(TITLES)] + (f' {n // len(TITLES)}' if n >= len(TITLES) else '')
+                        for n in range(args.queries)]
+        self.query_weights = [1 / (rank + 1) for rank in range(args.queries)]
+        self.users = args.users
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self._actions: Dict[int, str] = {}  # update_id -> action, to attribute errors
+
+    async def on_error(self, update: object, context: Any) -> None:
+        action = self._actions.get(getattr(update, 'update_id', None), 'unknown')
+        self.errors[action] += 1
+        if sum(self.errors.values()) <= 3:
+            logger.warning("%s update failed", action, exc_info=context.error)
+
+    def _next_update(self, user_id: int) -> Any:
+        action = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        snapshot = self.snapshots.latest(user_id)
+        if action in ('details', 'page', 'back', 'add') and snapshot is None:
+            action = 'search'  # 还没有搜索结果可点
+        if action == 'search':
+            query = self.random.choices(self.queries, weights=self.query_weights)[0]
+            return action, self.updates.command(user_id, f'/search {query}')
+        if action in ('details', 'add'):
+            item_type, hits = self.random.choice([('movie', snapshot.movies), ('tv', snapshot.tv_shows)])
+            if not hits:
+                item_type, hits = ('tv', snapshot.tv_shows) if item_type == 'movie' else ('movie', snapshot.movies)
+            hit = self.random.choice(hits)
+            prefix = 'add_' if action == 'add' else ''
+            return action, self.updates.button(user_id, f'{prefix}{item_type}_{hit.item_id}')
+        if action == 'page':
+            page = self.random.randrange(snapshot.page_count)
+            return action, self.updates.button(user_id, f'sp_{snapshot.key}_{page}')
+        if action == 'back':
+            return action, self.updates.button(user_id, 'back_to_search')
+        return action, self.updates.command(user_id, f'/{action}')
+
+    async def run(self, count: int, record: bool = True) -> float:
+        """Send count updates and return the elapsed time."""
+        processor = self.application.update_processor
+        sequence = itertools.count()
+
+        async def user(user_id: int) -> None:
+            while next(sequence) < count:
+                action, update = self._next_update(user_id)
+                self._actions[update.update_id] = action
+                start = time.perf_counter()
+                await processor.process_update(update, self.application.process_update(update))
+                if record:
+                    self.latencies[action].append(time.perf_counter() - start)
+                del self._actions[update.update_id]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(100000 + n) for n in range(self.users)))
+        return time.perf_counter() - start
+
+
+async def run_weekly_broadcast(application: Any, subscribers: int) -> Dict[str, Any]:
+    """Send this week's trending message to freshly added subscribers."""
+    from bot.broadcast import start_broadcast
+    from bot.trending import get_trending_snapshot
+    from data.database import add_subscriber, write_queue
+
+    await asyncio.gather(*(add_subscriber(5000000 + n) for n in range(subscribers)))
+    await write_queue.flush()
+    snapshot = await get_trending_snapshot('week')
+    result = await start_broadcast(application.bot, f'benchmark:{time.time()}', snapshot.message,
+                                   snapshot.poster_path)
+    return {'subscribers': subscribers, 'sent': result.sent, 'failed': result.failed,
+            'elapsed': result.elapsed, 'messages_per_second': result.throughput}
+
+
+async def fetch_mock_stats(tmdb_url: str) -> Dict[str, int]:
+    import httpx
+
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f'{tmdb_url}/_stats')).json()
+
+
+async def run_benchmark(args: argparse.Namespace, tmdb_url: str) -> Dict[str, Any]:
+    import main as bot
+    from benchmarks.fake_telegram import FakeTelegramRequest
+
+    logging.getLogger().setLevel(args.log_level)
+    telegram = FakeTelegramRequest(args.telegram_latency / 1000)
+    application = bot.build_application(request=telegram)
+    replay = TrafficReplay(application, args)
+    application.add_error_handler(replay.on_error)
+    await application.initialize()
+    try:
+        await replay.run(args.warmup, record=False)
+        elapsed = await replay.run(args.updates)
+        broadcast = await run_weekly_broadcast(application, args.subscribers) if args.subscribers else None
+        tmdb_stats = await fetch_mock_stats(tmdb_url)
+    finally:
+        await application.shutdown()
+        await bot.post_shutdown(application)
+
+    latency = {action: dict(percentiles(values), count=len(values), errors=replay.errors[action])
+               for action, values in sorted(replay.latencies.items())}
+    latency['all'] = dict(percentiles([value for values in replay.latencies.values() for value in values]),
+                          count=args.updates, errors=sum(replay.errors.values()))
+    return {
+        'updates': args.updates,
+        'users': args.users,
+        'elapsed': elapsed,
+        'updates_per_second': args.updates / elapsed,
+        'latency_ms': latency,
+        'broadcast': broadcast,
+        'tmdb': tmdb_stats,
+        'telegram_calls': dict(telegram.calls),
+    }
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"Traffic: {results['updates']} updates from {results['users']} users in {results['elapsed']:.2f}s "
+          f"-> {results['updates_per_second']:.1f} updates/s")
+    print(f"{'action':<12}{'count':>7}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for action, stats in results['latency_ms'].items():
+        print(f"{action:<12}{stats['count']:>7}{stats['errors']:>8}{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+              f"{stats['p99']:>9.1f}{stats['max']:>9.1f}")
+    broadcast = results['broadcast']
+    if broadcast:
+        print(f"Broadcast: {broadcast['subscribers']} subscribers in {broadcast['elapsed']:.2f}s "
+              f"-> {broadcast['messages_per_second']:.1f} msg/s ({broadcast['sent']} sent, "
+              f"{broadcast['failed']} failed)")
+    tmdb = results['tmdb']
+    print(f"TMDB: {tmdb.get('requests', 0)} requests, {tmdb.get('errors', 0)} errors, "
+          f"{tmdb.get('rate_limited', 0)} rate limited, {tmdb.get('images', 0)} posters")
+    print("Telegram: " + ', '.join(f"{method}={count}" for method, count in sorted(results['telegram_calls'].items())))
+
+
+def find_regressions(baseline: Dict[str, Any], results: Dict[str, Any], tolerance: float) -> List[str]:
+    """Throughput drops and tail latency increases beyond tolerance, relative to baseline."""
+    regressions = []
+
+    def slower(name: str, before: float, after: float, higher_is_better: bool) -> None:
+        if not before:
+            return
+        change = (after - before) / before
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {before:.1f} -> {after:.1f} ({change:+.0%})")
+
+    slower('updates/s', baseline['updates_per_second'], results['updates_per_second'], True)
+    for action, stats in results['latency_ms'].items():
+        before = baseline['latency_ms'].get(action)
+        # 样本太少的动作百分位数波动大，只比较总体
+        if before and (action == 'all' or min(before['count'], stats['count']) >= MIN_COMPARED_SAMPLES):
+            slower(f'{action} p95 ms', before['p95'], stats['p95'], False)
+            slower(f'{action} p99 ms', before['p99'], stats['p99'], False)
+    if baseline.get('broadcast') and results['broadcast']:
+        slower('broadcast msg/s', baseline['broadcast']['messages_per_second'],
+               results['broadcast']['messages_per_second'], True)
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=args.log_level)
+    workdir = tempfile.mkdtemp(prefix='bot-benchmark-')
+    mock = start_mock_tmdb(args)
+    try:
+        tmdb_url = mock.stdout.readline().strip()
+        if not tmdb_url:
+            raise RuntimeError("TMDB stand-in did not start")
+        configure_environment(args, workdir, tmdb_url)
+        results = asyncio.run(run_benchmark(args, tmdb_url))
+    finally:
+        mock.terminate()
+        mock.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
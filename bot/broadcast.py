@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, BadRequest, RetryAfter, TimedOut, NetworkError, TelegramError
+from telegram.ext import ContextTypes
+
+from bot.utils import send_poster
+from config import BROADCAST_WORKERS, BROADCAST_RATE_LIMIT, BROADCAST_MAX_ATTEMPTS, BROADCAST_PROGRESS_BATCH, \
+    POSTER_SIZE_BROADCAST, BROADCAST_CHUNK_SIZE, BROADCAST_SHARD_INDEX, BROADCAST_SHARD_COUNT, METRICS_ENABLED
+from data.database import iter_subscriber_ids, iter_watcher_ids, remove_subscriber, get_or_create_broadcast, \
+    get_unfinished_broadcasts, get_delivered_user_ids, record_deliveries, finish_broadcast
+from services.metrics import BROADCAST_MESSAGES, BROADCAST_SEND_LATENCY, BROADCAST_THROUGHPUT
+from services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# 全局 Telegram 发送限速，所有广播共享
+telegram_limiter = RateLimiter(BROADCAST_RATE_LIMIT, burst=int(BROADCAST_RATE_LIMIT))
+
+# Errors meaning the chat can never receive messages from the bot again
+UNREACHABLE_CHAT_ERRORS = ("chat not found", "user is deactivated", "bot was blocked")
+
+# Broadcasts currently being delivered by this process
+_running: Set[int] = set()
+
+# Broadcasts whose key starts with this go to the watchers of one item: 'watchers:<type>:<id>:<event>'
+WATCHERS_KEY_PREFIX = 'watchers:'
+
+Recipients = Callable[[], AsyncIterator[List[int]]]
+
+
+@dataclass
+class BroadcastResult:
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Messages processed per second."""
+        processed = self.sent + self.failed + self.blocked
+        return processed / self.elapsed if self.elapsed else 0.0
+
+
+async def _send(bot: Bot, chat_id: int, text: str, photo: Optional[str]) -> None:
+    if photo:
+        await send_poster(partial(bot.send_photo, chat_id=chat_id), photo, size=POSTER_SIZE_BROADCAST,
+                          caption=text, parse_mode=ParseMode.MARKDOWN)
+    else:
+        await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN)
+
+
+async def _deliver(bot: Bot, chat_id: int, text: str, photo: Optional[str]) -> str:
+    """
+    Send one broadcast message, retrying transient failures.
+
+    :return: Delivery status: 'sent', 'failed' or 'blocked'
+    """
+    for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+        await telegram_limiter.acquire()
+        try:
+            await _send(bot, chat_id, text, photo)
+            telegram_limiter.on_success()
+            return 'sent'
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') \
+                else float(e.retry_after)
+            telegram_limiter.on_rate_limited(retry_after)
+            logger.warning("Broadcast flood-limited, retrying chat %s after %ss", chat_id, retry_after)
+        except Forbidden:
+            return 'blocked'
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in UNREACHABLE_CHAT_ERRORS):
+                return 'blocked'
+            logger.warning("Broadcast to chat %s rejected: %s", chat_id, e)
+            return 'failed'
+        except (TimedOut, NetworkError) as e:
+            if attempt == BROADCAST_MAX_ATTEMPTS:
+                break
+            delay = min(30.0, 2 ** attempt)
+            logger.warning("Broadcast to chat %s failed (%s), retrying in %ss", chat_id, e, delay)
+            await asyncio.sleep(delay)
+        except TelegramError as e:
+            logger.warning("Broadcast to chat %s failed: %s", chat_id, e)
+            return 'failed'
+    return 'failed'
+
+
+def _subscribers() -> AsyncIterator[List[int]]:
+    return iter_subscriber_ids(BROADCAST_CHUNK_SIZE, BROADCAST_SHARD_INDEX, BROADCAST_SHARD_COUNT)
+
+
+def _recipients_for(key: str) -> Recipients:
+    """The audience of a broadcast, derived from its key so resumed broadcasts reach the same users."""
+    if key.startswith(WATCHERS_KEY_PREFIX):
+        _, item_type, item_id = key.split(':')[:3]
+        return lambda: iter_watcher_ids(item_type, int(item_id), BROADCAST_CHUNK_SIZE, BROADCAST_SHARD_INDEX,
+                                        BROADCAST_SHARD_COUNT)
+    return _subscribers
+
+
+def watchers_key(item_type: str, item_id: int, event: str) -> str:
+    """Broadcast key for notifying the users watching an item about an event, e.g. 'released'."""
+    return f"{WATCHERS_KEY_PREFIX}{item_type}:{item_id}:{event}"
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int, text: str, photo: Optional[str] = None,
+                        workers: int = BROADCAST_WORKERS, recipients: Recipients = _subscribers) -> BroadcastResult:
+    """
+    Deliver a broadcast to every recipient it has not been processed for yet.
+
+    Recipients (all subscribers by default) are streamed from the database in chunks of BROADCAST_CHUNK_SIZE, so
+    sending starts right away and memory does not grow with the audience. When
+    BROADCAST_SHARD_COUNT > 1 only this process's shard of subscribers is processed.
+    Sends run on concurrent workers under the global Telegram rate limiter. Outcomes are
+    persisted in batches of BROADCAST_PROGRESS_BATCH, so an interrupted broadcast resumes
+    where it stopped; at most the last unsaved batch may be sent twice. Subscribers who
+    blocked the bot are removed.
+
+    :param bot: Telegram bot
+    :param broadcast_id: ID of the broadcast row holding the progress
+    :param text: Message text or photo caption
+    :param photo: Optional TMDB poster path to send with the message
+    :param workers: Number of concurrent senders
+    :param recipients: Factory of the async iterator over chunks of recipient user IDs
+    :return: Delivery counters
+    """
+    result = BroadcastResult()
+    if broadcast_id in _running:
+        logger.info("Broadcast %s is already running", broadcast_id)
+        return result
+    _running.add(broadcast_id)
+    try:
+        return await _run(bot, broadcast_id, text, photo, workers, recipients, result)
+    finally:
+        _running.discard(broadcast_id)
+
+
+async def _run(bot: Bot, broadcast_id: int, text: str, photo: Optional[str], workers: int,
+               recipients: Recipients, result: BroadcastResult) -> BroadcastResult:
+    start = time.monotonic()
+    # 有界队列：订阅者按块从数据库流式读取，内存占用与订阅者总数无关
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CHUNK_SIZE)
+
+    async def produce() -> None:
+        async for chunk in recipients():
+            delivered = await get_delivered_user_ids(broadcast_id, chunk)
+            for chat_id in chunk:
+                if chat_id in delivered:
+                    result.skipped += 1
+                else:
+                    await queue.put(chat_id)
+        for _ in range(workers):
+            await queue.put(None)
+
+    pending: List[Tuple[int, str]] = []
+
+    async def flush() -> None:
+        if pending:
+            batch = pending[:]
+            pending.clear()
+            await record_deliveries(broadcast_id, batch)
+
+    async def worker() -> None:
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            sent_at = time.perf_counter()
+            try:
+                status = await _deliver(bot, chat_id, text, photo)
+                if status == 'blocked':
+                    await remove_subscriber(chat_id)
+            except Exception:
+                # 数据库或海报缓存出错时只记这一位失败，不让 worker 退出
+                logger.exception("Broadcast %s: delivery to %s failed", broadcast_id, chat_id)
+                status = 'failed'
+            setattr(result, status, getattr(result, status) + 1)
+            if METRICS_ENABLED:
+                BROADCAST_SEND_LATENCY.observe(time.perf_counter() - sent_at)
+                BROADCAST_MESSAGES.inc(status)
+            pending.append((chat_id, status))
+            if len(pending) >= BROADCAST_PROGRESS_BATCH:
+                try:
+                    await flush()
+                except Exception:
+                    # 这批进度未保存，恢复广播时可能重复发送
+                    logger.exception("Broadcast %s: failed to save progress", broadcast_id)
+
+    workers = max(1, workers)
+    # 生产者与 worker 一起等待：任一方出错时取消其余任务，生产者不会卡在已满的队列上
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await flush()
+    await finish_broadcast(broadcast_id)
+    result.elapsed = time.monotonic() - start
+    BROADCAST_THROUGHPUT.set(result.throughput)
+    logger.info("Broadcast %s done: %s sent, %s failed, %s blocked, %s skipped (%.1f msg/s)",
+                broadcast_id, result.sent, result.failed, result.blocked, result.skipped, result.throughput)
+    return result
+
+
+def _shard_suffix() -> str:
+    """Suffix keeping the progress of each shard of a broadcast separate."""
+    return f":shard{BROADCAST_SHARD_INDEX}of{BROADCAST_SHARD_COUNT}" if BROADCAST_SHARD_COUNT > 1 else ""
+
+
+def _belongs_to_this_shard(key: str) -> bool:
+    suffix = _shard_suffix()
+    return key.endswith(suffix) if suffix else ':shard' not in key
+
+
+async def start_broadcast(bot: Bot, key: str, text: str, photo: Optional[str] = None) -> BroadcastResult:
+    """
+    Start (or continue) the broadcast identified by key.
+
+    :param bot: Telegram bot
+    :param key: Unique broadcast key; reusing a key never messages a user twice. Keys made
+        by watchers_key go to the item's watchers, all others to every subscriber
+    :param text: Message text or photo caption
+    :param photo: Optional TMDB poster path to send with the message
+    :return: Delivery counters
+    """
+    broadcast_id = await get_or_create_broadcast(key + _shard_suffix(), text, photo)
+    return await run_broadcast(bot, broadcast_id, text, photo, recipients=_recipients_for(key))
+
+
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that finishes broadcasts interrupted by a crash or restart."""
+    for broadcast_id, key, text, photo in await get_unfinished_broadcasts():
+        # 只继续属于本进程分片的广播
+        if not _belongs_to_this_shard(key):
+            continue
+        logger.info("Resuming broadcast %s", key)
+        await run_broadcast(context.bot, broadcast_id, text, photo, recipients=_recipients_for(key))
@@ -1,22 +1,48 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import httpx
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
-from data.database import add_to_watchlist, get_watchlist, remove_from_watchlist, is_in_watchlist, get_all_subscribers, \
-    add_subscriber
-from services.movie_service import search_movies, search_tv_shows, get_movie_details, get_tv_show_details, \
-    get_trending_items
+from bot.broadcast import start_broadcast
+from bot.search_snapshots import SearchSnapshot, make_snapshot, search_snapshots
+from bot.trending import get_trending_snapshot
+from bot.utils import send_poster
+from bot.update_processor import get_update_stats
+from config import DETAIL_PREFETCH_COUNT, ADMIN_USER_IDS, METRICS_ENABLED
+from data.database import add_to_watchlist, get_watchlist_page, remove_from_watchlist, is_in_watchlist, \
+    add_subscriber, WatchlistPage, watchlist_index
+from services.metrics import latency_summary, HANDLER_LATENCY, TMDB_LATENCY, DB_LATENCY, \
+    BROADCAST_MESSAGES, BROADCAST_THROUGHPUT
+from services.movie_service import search_titles, get_movie_details, get_tv_show_details, peek_details, \
+    prefetch_details, get_cache_stats, get_breaker_stats, get_rate_limiter_stats
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+# TMDB 不可用、展示缓存数据时附加的提示
+STALE_NOTICE = "⚠️ TMDB 暂时无法访问，以下信息可能不是最新的。"
+# TMDB 不可用且没有缓存数据时的回复
+UNAVAILABLE_MESSAGE = "⚠️ TMDB 暂时无法访问，请稍后再试。"
+
+# 每个用户正在进行的详情预取，用户翻页或重新搜索时取消
+_detail_prefetches: Dict[int, asyncio.Task] = {}
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
     await update.message.reply_html(
-        f"你好 {user.mention_html()}！我是你的电影和电视剧机器人。使用 /help 查看我能做什么。"
+        f"你好 {user.mention_html()}！我是你的电影和电视剧机器人。"
+        "使用 /help 查看我能做什么。"
     )
     # 添加用户到订阅者列表
-    add_subscriber(user.id)
+    await add_subscriber(user.id)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
@@ -26,64 +52,69 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     /add <类型> <ID> - 将电影或电视剧添加到你的观看列表
     /watchlist - 查看你的观看列表
     /remove <ID> - 从你的观看列表中删除一个项目
+    在任意聊天中输入 @机器人用户名 <标题> - 内联搜索并分享电影或电视剧
     """
     await update.message.reply_text(help_text)
 
 
-async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Search for movies and TV shows and display results with inline keyboard."""
-    if update.message:
-        query = ' '.join(context.args)
-        if not query:
-            await update.message.reply_text("请在 /search 后提供搜索词")
-            return
-    else:  # 处理回调查询的情况
-        query = context.user_data.get('last_search_query', '')
-        if not query:
-            await update.callback_query.message.reply_text("无法找到上一次的搜索查询。请尝试新的搜索。")
-            return
-
-    # 保存搜索查询以便后续使用
-    context.user_data['last_search_query'] = query
-
-    movies = search_movies(query)
-    tv_shows = search_tv_shows(query)
-
-    if not movies and not tv_shows:
-        message = "没有找到相关结果。"
-        if update.message:
-            await update.message.reply_text(message)
-        else:
-            await update.callback_query.message.reply_text(message)
-        return
-
-    # 分别对电影和电视剧进行排序
-    movies = sorted(movies, key=lambda x: x.get('popularity', 0), reverse=True)
-    tv_shows = sorted(tv_shows, key=lambda x: x.get('popularity', 0), reverse=True)
-
+def _render_search_page(snapshot: SearchSnapshot, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Build the text and result buttons of one page of a search snapshot."""
+    movies, tv_shows = snapshot.page_items(page)
     keyboard = []
     # 添加电影结果
     if movies:
         keyboard.append([InlineKeyboardButton("电影", callback_data="header_movie")])
-        for item in movies[:5]:  # 限制为前5个电影结果
-            title = item['title']
-            year = item['release_date'][:4]
-            rating = f"⭐ {item['vote_average']:.1f}" if item.get('vote_average') else "暂无评分"
-            button_text = f"🎬 {title} ({year}) - {rating}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"movie_{item['id']}")])
+        for hit in movies:
+            rating = f"⭐ {hit.rating:.1f}" if hit.rating else "暂无评分"
+            button_text = f"🎬 {hit.title} ({hit.year}) - {rating}"
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"movie_{hit.item_id}")])
 
     # 添加电视剧结果
     if tv_shows:
         keyboard.append([InlineKeyboardButton("电视剧", callback_data="header_tv")])
-        for item in tv_shows[:5]:  # 限制为前5个电视剧结果
-            title = item['name']
-            year = item['first_air_date'][:4]
-            rating = f"⭐ {item['vote_average']:.1f}" if item.get('vote_average') else "暂无评分"
-            button_text = f"📺 {title} ({year}) - {rating}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"tv_{item['id']}")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = f"搜索结果 - \"{query}\":"
+        for hit in tv_shows:
+            rating = f"⭐ {hit.rating:.1f}" if hit.rating else "暂无评分"
+            button_text = f"📺 {hit.title} ({hit.year}) - {rating}"
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"tv_{hit.item_id}")])
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"sp_{snapshot.key}_{page - 1}"))
+    if page + 1 < snapshot.page_count:
+        buttons.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"sp_{snapshot.key}_{page + 1}"))
+    if buttons:
+        keyboard.append(buttons)
+
+    message_text = f"搜索结果 - \"{snapshot.query}\":"
+    if snapshot.page_count > 1:
+        message_text += f" (第 {page + 1}/{snapshot.page_count} 页)"
+    if snapshot.stale:
+        message_text += f"\n{STALE_NOTICE}"
+    return message_text, InlineKeyboardMarkup(keyboard)
+
+
+def _prefetch_page_details(user_id: int, snapshot: SearchSnapshot, page: int) -> None:
+    """Start loading the details of the top results on a page, replacing the user's previous prefetch."""
+    previous = _detail_prefetches.pop(user_id, None)
+    if previous is not None:
+        previous.cancel()
+    if DETAIL_PREFETCH_COUNT <= 0:
+        return
+    movies, tv_shows = snapshot.page_items(page)
+    items = [('movie', hit.item_id) for hit in movies[:DETAIL_PREFETCH_COUNT]] + \
+        [('tv', hit.item_id) for hit in tv_shows[:DETAIL_PREFETCH_COUNT]]
+    task = asyncio.create_task(prefetch_details(items))
+    _detail_prefetches[user_id] = task
+    task.add_done_callback(lambda done: _detail_prefetches.pop(user_id, None)
+                           if _detail_prefetches.get(user_id) is done else None)
+
+
+async def _show_search_page(update: Update, snapshot: SearchSnapshot, page: int) -> None:
+    """Send a page of search results, or redraw it in place when coming from a button."""
+    snapshot.page = page
+    message_text, reply_markup = _render_search_page(snapshot, page)
+    # 用户很可能会点开其中一个结果，提前在后台加载详情
+    _prefetch_page_details(update.effective_user.id, snapshot, page)
 
     if update.message:
         await update.message.reply_text(message_text, reply_markup=reply_markup)
@@ -103,6 +134,58 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 raise
 
 
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Search for movies and TV shows and display results with inline keyboard."""
+    if update.message:
+        query = ' '.join(context.args)
+        if not query:
+            await update.message.reply_text("请在 /search 后提供搜索词")
+            return
+    else:  # 处理回调查询的情况
+        query = context.user_data.get('last_search_query', '')
+        if not query:
+            await update.callback_query.message.reply_text(
+                "无法找到上一次的搜索查询。请尝试新的搜索。")
+            return
+
+    # 保存搜索查询以便后续使用
+    context.user_data['last_search_query'] = query
+    user_id = update.effective_user.id
+
+    # 最近搜索过的相同查询直接使用快照
+    snapshot = search_snapshots.get(user_id, query)
+    if snapshot is None:
+        # 优先使用本地标题索引，结果太少时再查询 TMDB
+        movies, tv_shows = await search_titles(query)
+
+        if not movies and not tv_shows:
+            message = "没有找到相关结果。"
+            if update.message:
+                await update.message.reply_text(message)
+            else:
+                await update.callback_query.message.reply_text(message)
+            return
+
+        # 分别对电影和电视剧进行排序，只保留展示所需的字段
+        snapshot = make_snapshot(query, movies, tv_shows)
+        search_snapshots.put(user_id, snapshot)
+
+    await _show_search_page(update, snapshot, 0)
+
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Turn the page of the search results the tapped message shows (sp_<snapshot key>_<page>)."""
+    query = update.callback_query
+    parts = query.data.split('_')
+    # 旧版本发出的按钮不带快照键，无法确定对应的搜索，按过期处理
+    snapshot = search_snapshots.find(update.effective_user.id, parts[1]) if len(parts) == 3 else None
+    if snapshot is None:
+        await query.message.reply_text("搜索结果已过期。请尝试新的搜索。")
+        return
+    page = min(int(parts[2]), snapshot.page_count - 1)
+    await _show_search_page(update, snapshot, page)
+
+
 async def item_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display details for a movie or TV show."""
     query = update.callback_query
@@ -112,25 +195,27 @@ async def item_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user_id = update.effective_user.id
 
     if item_type == 'movie':
-        details = get_movie_details(item_id)
+        details = await get_movie_details(item_id)
         title = details['title']
         release_date = details['release_date']
         overview = details['overview']
-        poster_url = details.get('poster_url')
+        poster_path = details.get('poster_path')
     else:  # TV show
-        details = get_tv_show_details(item_id)
+        details = await get_tv_show_details(item_id)
         title = details['name']
         release_date = details['first_air_date']
         overview = details['overview']
-        poster_url = details.get('poster_url')
+        poster_path = details.get('poster_path')
 
     details_text = (f"{'电影' if item_type == 'movie' else '电视剧'}: {title}\n"
                     f"发布日期: {release_date}\n"
                     f"评分: {details['vote_average']}/10\n\n"
                     f"概述: {overview[:200]}...")
+    if details.stale:
+        details_text = f"{STALE_NOTICE}\n\n{details_text}"
 
     # 检查项目是否已经在观看列表中
-    in_watchlist = is_in_watchlist(user_id, item_id, item_type)
+    in_watchlist = await is_in_watchlist(user_id, item_id, item_type)
 
     keyboard = [
         [
@@ -146,28 +231,74 @@ async def item_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if poster_url:
-        await query.message.reply_photo(photo=poster_url, caption=details_text, reply_markup=reply_markup)
+    if poster_path:
+        await send_poster(query.message.reply_photo, poster_path, caption=details_text, reply_markup=reply_markup)
         await query.message.delete()
     else:
         await query.edit_message_text(text=details_text, reply_markup=reply_markup)
 
+def _encode_watchlist_cursor(added_date: datetime, row_id: int) -> str:
+    """Encode a keyset cursor compactly for callback_data (limited to 64 bytes)."""
+    return f"{int((added_date - _EPOCH).total_seconds() * 1_000_000)}_{row_id}"
+
+
+def _decode_watchlist_cursor(value: str) -> Tuple[datetime, int]:
+    micros, row_id = value.split('_')
+    return _EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+
+
+def _render_watchlist_page(page: WatchlistPage) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Build the text and prev/next buttons of a watchlist page."""
+    lines = ["你的观看列表：", ""]
+    for item in page.items:
+        item_type = "电影" if item.item_type == "movie" else "电视剧"
+        lines.append(f"- {item.title} ({item_type}) - ID: {item.item_id}")
+    lines += ["", "要删除一个项目，请使用 /remove <ID>"]
+
+    buttons = []
+    if page.has_prev:
+        first = page.items[0]
+        cursor = _encode_watchlist_cursor(first.added_date, first.id)
+        buttons.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"wl_p_{cursor}"))
+    if page.has_next:
+        last = page.items[-1]
+        cursor = _encode_watchlist_cursor(last.added_date, last.id)
+        buttons.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"wl_n_{cursor}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
 async def view_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """View the user's watchlist."""
+    """View the first page of the user's watchlist."""
     user_id = update.effective_user.id
-    watchlist = get_watchlist(user_id)
+    page = await get_watchlist_page(user_id)
 
-    if not watchlist:
+    if not page.items:
         await update.message.reply_text("你的观看列表是空的。")
         return
 
-    response = "你的观看列表：\n\n"
-    for item in watchlist:
-        item_type = "电影" if item.item_type == "movie" else "电视剧"
-        response += f"- {item.title} ({item_type}) - ID: {item.item_id}\n"
+    text, reply_markup = _render_watchlist_page(page)
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
-    response += "\n要删除一个项目，请使用 /remove <ID>"
-    await update.message.reply_text(response)
+
+async def watchlist_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Turn the page of a watchlist message in place."""
+    query = update.callback_query
+    _, direction, cursor = query.data.split('_', 2)
+    page = await get_watchlist_page(update.effective_user.id, _decode_watchlist_cursor(cursor),
+                                    backwards=direction == 'p')
+    if not page.items:
+        # 列表在翻页期间被清空，回到第一页
+        page = await get_watchlist_page(update.effective_user.id)
+    if not page.items:
+        await query.edit_message_text("你的观看列表是空的。")
+        return
+
+    text, reply_markup = _render_watchlist_page(page)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except telegram.error.BadRequest as e:
+        if str(e) != "Message is not modified":
+            raise
 
 async def remove_from_watchlist_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Remove a movie or TV show from the watchlist."""
@@ -178,7 +309,7 @@ async def remove_from_watchlist_handler(update: Update, context: ContextTypes.DE
     user_id = update.effective_user.id
     item_id = int(context.args[0])
 
-    if remove_from_watchlist(user_id, item_id):
+    if await remove_from_watchlist(user_id, item_id):
         await update.message.reply_text("项目已从你的观看列表中删除。")
     else:
         await update.message.reply_text("在你的观看列表中未找到该项目。")
@@ -189,7 +320,7 @@ async def movie_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await query.answer()
 
     movie_id = int(query.data.split('_')[1])
-    movie = get_movie_details(movie_id)
+    movie = await get_movie_details(movie_id)
 
     details = f"标题: {movie['title']}\n"
     details += f"上映日期: {movie['release_date']}\n"
@@ -216,20 +347,24 @@ async def add_to_watchlist_callback(update: Update, context: ContextTypes.DEFAUL
     item_id = int(item_id)
     user_id = update.effective_user.id
 
-    if item_type == 'movie':
-        details = get_movie_details(item_id)
-        title = details['title']
+    # 标题优先取自已缓存的详情或搜索结果快照，避免再次请求 TMDB
+    details = peek_details(item_type, item_id)
+    snapshot = search_snapshots.latest(user_id)
+    hit = snapshot.find(item_type, item_id) if snapshot else None
+    if details is not None:
+        title = details['title'] if item_type == 'movie' else details['name']
+    elif hit is not None:
+        title = hit.title
+    elif item_type == 'movie':
+        title = (await get_movie_details(item_id))['title']
     else:  # TV show
-        details = get_tv_show_details(item_id)
-        title = details['name']
+        title = (await get_tv_show_details(item_id))['name']
 
-    # 检查项目是否已经在观看列表中
-    if is_in_watchlist(user_id, item_id, item_type):
-        await query.message.reply_text(f"{title} 已经在你的观看列表中！")
-    else:
-        # 假设你有一个 add_to_watchlist 函数在 database 模块中
-        add_to_watchlist(user_id, item_id, item_type, title)
+    # 唯一索引保证不会重复添加，返回 False 表示已经在观看列表中
+    if await add_to_watchlist(user_id, item_id, item_type, title):
         await query.message.reply_text(f"已将 {title} 添加到你的观看列表！")
+    else:
+        await query.message.reply_text(f"{title} 已经在你的观看列表中！")
 
     # 更新按钮状态
     keyboard = [
@@ -253,15 +388,24 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     elif query.data.startswith("add_"):
         # 处理添加到观看列表的逻辑
         await add_to_watchlist_callback(update, context)
+    elif query.data.startswith("sp_"):
+        # 搜索结果翻页
+        await search_page_callback(update, context)
+    elif query.data.startswith("wl_"):
+        # 观看列表翻页
+        await watchlist_page_callback(update, context)
 
 
 async def back_to_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
 
-    last_search_query = context.user_data.get('last_search_query')
-    if last_search_query:
-        # 重新执行搜索
+    snapshot = search_snapshots.latest(update.effective_user.id)
+    if snapshot is not None:
+        # 直接从快照重绘搜索结果，不再请求 TMDB
+        await _show_search_page(update, snapshot, snapshot.page)
+    elif context.user_data.get('last_search_query'):
+        # 快照已被淘汰，重新执行搜索
         await search(update, context)
     else:
         await query.message.reply_text("无法返回上一次搜索结果。请尝试新的搜索。")
@@ -270,77 +414,75 @@ async def back_to_search(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def trending_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler for the /trending command."""
     time_window = context.args[0] if context.args and context.args[0] in ['day', 'week'] else 'week'
-    trending_items = get_trending_items(time_window)
-
-    # 分别获取电影和电视剧
-    movies = [item for item in trending_items if item['item_type'] == 'movie'][:5]
-    tv_shows = [item for item in trending_items if item['item_type'] == 'tv'][:5]
-
-    # 获取排名最高的电影
-    top_movie = movies[0]
-    top_movie_poster_url = f"{top_movie['poster_url']}"
-
-    # 获取当前日期
-    from datetime import datetime
-    current_date = datetime.now().strftime("%Y-%m-%d")
+    # 快照由后台任务定时刷新，这里不请求 TMDB
+    snapshot = await get_trending_snapshot(time_window)
+    message_text = f"{STALE_NOTICE}\n\n{snapshot.message}" if snapshot.stale else snapshot.message
 
-    # 创建消息
-    message = f"📅 *Date:* {current_date}\n"
-    message += f"📊 *Trending:* {time_window.capitalize()}\n"
-    message += "🔗 *GitHub:* [SimonGino/tg-bot-tmdb](https://github.com/SimonGino/tg-bot-tmdb)\n\n"
-
-    # 创建消息
-    message += "🎬 *Trending Movies:*\n"
-    for idx, movie in enumerate(movies, start=1):
-        message += f"{idx}. [{movie['title']}] 评分: {movie['vote_average']}\n"
-
-    message += "\n📺 *Trending TV Shows:*\n"
-    for idx, tv_show in enumerate(tv_shows, start=1):
-        message += f"{idx}. [{tv_show['name']}] 评分: {tv_show['vote_average']}\n"
-
-    if top_movie_poster_url:
-        await update.message.reply_photo(photo=top_movie_poster_url, caption=message, parse_mode=ParseMode.MARKDOWN)
+    if snapshot.poster_path:
+        await send_poster(update.message.reply_photo, snapshot.poster_path, caption=message_text,
+                          parse_mode=ParseMode.MARKDOWN)
     else:
-        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text(message_text, parse_mode=ParseMode.MARKDOWN)
 
 
 async def send_weekly_trending(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Scheduled task to send weekly trending movies and TV shows to all subscribers."""
-    time_window = 'week'
-    trending_items = get_trending_items(time_window)
-
-    # 分别获取电影和电视剧
-    movies = [item for item in trending_items if item['item_type'] == 'movie'][:5]
-    tv_shows = [item for item in trending_items if item['item_type'] == 'tv'][:5]
-
-    # 获取排名最高的电影
-    top_movie = movies[0]
-    top_movie_poster_url = f"{top_movie['poster_url']}"
+    snapshot = await get_trending_snapshot('week')
 
     # 获取当前日期
-    from datetime import datetime
     current_date = datetime.now().strftime("%Y-%m-%d")
 
-    # 创建消息
-    message = f"📅 *Date:* {current_date}\n"
-    message += f"📊 *Trending:* {time_window.capitalize()}\n"
-    message += "🔗 *GitHub:* [SimonGino/tg-bot-tmdb](https://github.com/SimonGino/tg-bot-tmdb)\n\n"
-
-    message += "🎬 *Trending Movies:*\n"
-    for idx, movie in enumerate(movies, start=1):
-        message += f"{idx}. [{movie['title']}] 评分: {movie['vote_average']}\n"
-
-    message += "\n📺 *Trending TV Shows:*\n"
-    for idx, tv_show in enumerate(tv_shows, start=1):
-        message += f"{idx}. [{tv_show['name']}] 评分: {tv_show['vote_average']}\n"
-
-    # 获取所有订阅者的 Chat ID
-    user_chat_ids = get_all_subscribers()
-
-    # 发送消息给所有订阅者
-    for chat_id in user_chat_ids:
-        if top_movie_poster_url:
-            await context.bot.send_photo(chat_id=chat_id, photo=top_movie_poster_url, caption=message,
-                                         parse_mode=ParseMode.MARKDOWN)
-        else:
-            await context.bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN)
+    # 发送消息给所有订阅者，进度保存在数据库中，中断后可继续
+    await start_broadcast(context.bot, f"weekly_trending:{current_date}", snapshot.message, snapshot.poster_path)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show latency percentiles and counters to admins (/stats)."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return  # 非管理员不回应，不暴露命令的存在
+    if not METRICS_ENABLED:
+        await update.message.reply_text("指标收集已关闭（METRICS_ENABLED=false）。")
+        return
+
+    update_stats = get_update_stats(context.application)
+    cache_stats = get_cache_stats()
+    broadcast_counts = ', '.join(f"{labels[0]}={int(value)}" for labels, value in
+                                 sorted(BROADCAST_MESSAGES.values.items())) or '无'
+    lines = ["📈 处理函数:"] + latency_summary(HANDLER_LATENCY)
+    lines += ["", "🎬 TMDB 接口:"] + latency_summary(TMDB_LATENCY)
+    lines += ["", "🗄 数据库:"] + latency_summary(DB_LATENCY)
+    lines += ["",
+              f"📨 广播: {broadcast_counts}; 上次吞吐 {BROADCAST_THROUGHPUT.values.get((), 0):.1f} msg/s",
+              f"📥 更新队列: {update_stats['queue_depth']}, "
+              f"处理中: {update_stats['processor'].get('active', 0)}",
+              f"💾 缓存: 命中 {cache_stats['hits']}, 过期命中 {cache_stats['stale_hits']}, "
+              f"未命中 {cache_stats['misses']}, 条目 {cache_stats['entries']}"]
+    busiest = sorted(update_stats['handlers'].items(), key=lambda entry: entry[1]['peak'], reverse=True)[:5]
+    concurrency = ', '.join(f"{name}={stats['active']}/{stats['peak']}" for name, stats in busiest) or '无'
+    lines.append(f"🔀 并发（当前/峰值）: {concurrency}")
+    index_stats = watchlist_index.stats()
+    lines.append(f"📋 观看列表索引: {index_stats['users']} 用户, {index_stats['items']} 条目, "
+                 f"命中率 {index_stats['hit_rate']:.0%}, 约 {index_stats['memory_bytes'] / 1024:.0f} KiB")
+    limiter = get_rate_limiter_stats()
+    lane_waits = '; '.join(f"{lane} 平均 {stats['avg_wait'] * 1000:.0f}ms / 最大 {stats['max_wait'] * 1000:.0f}ms"
+                           for lane, stats in limiter['lanes'].items())
+    lines.append(f"🚦 TMDB 限流等待: {lane_waits}")
+    open_breakers = [f"{endpoint}={stats['state']}" for endpoint, stats in sorted(get_breaker_stats().items())
+                     if stats['state'] != 'closed']
+    lines.append(f"🔌 TMDB 熔断: {', '.join(open_breakers) or '全部正常'}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Log errors raised by handlers and jobs; tell the user when TMDB could not be reached."""
+    if not isinstance(context.error, httpx.HTTPError):
+        logger.error("Unhandled error while processing %s", update, exc_info=context.error)
+        return
+    # 熔断或 TMDB 出错且没有缓存可用，至少让用户知道发生了什么
+    logger.warning("TMDB unavailable while processing an update: %s", context.error)
+    if not isinstance(update, Update) or update.effective_message is None:
+        return
+    try:
+        await update.effective_message.reply_text(UNAVAILABLE_MESSAGE)
+    except telegram.error.TelegramError:
+        logger.exception("Could not tell the user that TMDB is unavailable")
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from telegram import Update, InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
+
+from bot.trending import get_trending_snapshot
+from config import INLINE_DEBOUNCE, INLINE_CACHE_TIME, INLINE_RESULT_CACHE_SIZE, INLINE_RESULT_CACHE_TTL, \
+    INLINE_MAX_RESULTS
+from services.models import SearchHit, get_poster_url
+from services.movie_service import search_titles
+
+logger = logging.getLogger(__name__)
+
+# 每个用户当前正在处理的内联查询，新的查询到达时取消旧的
+_user_tasks: Dict[int, asyncio.Task] = {}
+# 查询词 -> (生成时间, 结果)，用户逐字输入时每个前缀各缓存一份
+_result_cache: "OrderedDict[str, Tuple[float, List[InlineQueryResultArticle]]]" = OrderedDict()
+
+
+def _cached_results(query: str) -> Optional[List[InlineQueryResultArticle]]:
+    entry = _result_cache.get(query)
+    if entry is None or time.monotonic() - entry[0] > INLINE_RESULT_CACHE_TTL:
+        return None
+    _result_cache.move_to_end(query)
+    return entry[1]
+
+
+def _cache_results(query: str, results: List[InlineQueryResultArticle]) -> None:
+    _result_cache[query] = (time.monotonic(), results)
+    _result_cache.move_to_end(query)
+    while len(_result_cache) > INLINE_RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+
+def _article(item: SearchHit) -> InlineQueryResultArticle:
+    """Build the inline result for one TMDB movie or TV show."""
+    is_movie = item.item_type == 'movie'
+    title = item.title
+    year = item.date[:4]
+    rating = f"⭐ {item.vote_average:.1f}" if item.vote_average else "暂无评分"
+    overview = item.overview
+    year_text = f" ({year})" if year else ''
+
+    text = f"{'🎬' if is_movie else '📺'} *{escape_markdown(title)}*{year_text}\n{rating}"
+    if overview:
+        text += f"\n\n{escape_markdown(overview[:300])}"
+    return InlineQueryResultArticle(
+        id=f"{item.item_type}_{item.id}",
+        title=f"{'🎬' if is_movie else '📺'} {title}{year_text}",
+        description=f"{rating} {overview[:80]}".strip(),
+        thumbnail_url=get_poster_url(item.poster_path, 'w92'),
+        input_message_content=InputTextMessageContent(text, parse_mode=ParseMode.MARKDOWN),
+    )
+
+
+async def _lookup(query: str) -> List[InlineQueryResultArticle]:
+    if query:
+        movies, tv_shows = await search_titles(query)
+        items = sorted(movies + tv_shows, key=lambda x: x.popularity, reverse=True)
+    else:
+        # 空查询显示本周热门，直接使用后台刷新的快照
+        items = (await get_trending_snapshot('week')).items
+    return [_article(item) for item in items[:INLINE_MAX_RESULTS]]
+
+
+async def _answer(update: Update, query: str) -> None:
+    # 等待用户停止输入，期间到达的新查询会取消本任务
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    results = _cached_results(query)
+    button = None
+    if results is None:
+        try:
+            results = await _lookup(query)
+            _cache_results(query, results)
+        except httpx.HTTPError as e:
+            # TMDB 不可用且没有缓存，返回空结果并提示，不让用户一直等待
+            logger.warning("TMDB unavailable for inline query %r: %s", query, e)
+            results = []
+            button = InlineQueryResultsButton(text="TMDB 暂时无法访问，请稍后再试",
+                                              start_parameter="tmdb_unavailable")
+    try:
+        await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME if button is None else 0,
+                                         button=button)
+    except BadRequest as e:
+        # 查询已过期（用户早已继续输入或关闭了窗口）
+        logger.debug("Could not answer inline query %r: %s", query, e)
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer `@bot title` inline queries with matching movies and TV shows."""
+    user_id = update.inline_query.from_user.id
+    query = ' '.join(update.inline_query.query.split()).lower()
+
+    previous = _user_tasks.pop(user_id, None)
+    if previous is not None:
+        previous.cancel()
+
+    results = _cached_results(query)
+    if results is not None:
+        # 缓存命中时无需等待
+        await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+        return
+
+    # 不在处理函数中等待结果，同一用户的下一次输入才能立刻到达并取消本次查询
+    task = asyncio.create_task(_answer(update, query))
+    _user_tasks[user_id] = task
+    task.add_done_callback(lambda finished: _task_done(user_id, finished))
+
+
+def _task_done(user_id: int, task: asyncio.Task) -> None:
+    if _user_tasks.get(user_id) is task:
+        del _user_tasks[user_id]
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Inline query failed", exc_info=task.exception())
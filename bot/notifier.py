@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, date
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from telegram import Bot
+from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
+
+from bot.broadcast import start_broadcast, watchers_key
+from config import WATCHLIST_NOTIFY_RECENT_DAYS, WATCHLIST_NOTIFY_CONCURRENCY
+from data.database import get_change_checkpoint, save_change_checkpoint, get_watched_item_ids
+from services.movie_service import get_changed_ids, get_movie_details, get_tv_show_details
+from services.rate_limiter import Priority, use_priority
+
+logger = logging.getLogger(__name__)
+
+# TMDB 的 /changes 接口最多查询 14 天
+MAX_CHANGES_WINDOW = timedelta(days=14)
+
+# (broadcast key, message, poster path)
+Notification = Tuple[str, str, Optional[str]]
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _is_recent(day: Optional[date], today: date) -> bool:
+    return day is not None and timedelta(0) <= today - day <= timedelta(days=WATCHLIST_NOTIFY_RECENT_DAYS)
+
+
+def _movie_notification(details: Dict[str, Any], today: date) -> Optional[Notification]:
+    """A notification if the movie was released recently."""
+    if details.get('status') != 'Released' or not _is_recent(_parse_date(details.get('release_date')), today):
+        return None
+    message = (f"🔔 你的观看列表中的电影 *{escape_markdown(details['title'])}* 已于 "
+               f"{details['release_date']} 上映！")
+    return watchers_key('movie', details['id'], 'released'), message, details.get('poster_path')
+
+
+def _tv_notification(details: Dict[str, Any], today: date) -> Optional[Notification]:
+    """A notification if a new episode of the show aired recently."""
+    episode = details.get('last_episode_to_air') or {}
+    if not _is_recent(_parse_date(episode.get('air_date')), today):
+        return None
+    season_number, episode_number = episode.get('season_number'), episode.get('episode_number')
+    message = (f"🔔 你的观看列表中的电视剧 *{escape_markdown(details['name'])}* 更新了 "
+               f"第 {season_number} 季第 {episode_number} 集（{episode['air_date']}）！")
+    event = f"s{season_number}e{episode_number}"
+    return watchers_key('tv', details['id'], event), message, details.get('poster_path')
+
+
+async def _find_notifications(item_type: str, item_ids: List[int], today: date) -> Tuple[List[Notification], int]:
+    """
+    Fetch fresh details of changed watched items and keep those with something to announce.
+
+    :return: Tuple of (notifications, number of items that failed with a transient error);
+        items TMDB answers with a 4xx, e.g. deleted titles, count as checked
+    """
+    semaphore = asyncio.Semaphore(WATCHLIST_NOTIFY_CONCURRENCY)
+    failed = 0
+
+    async def check(item_id: int) -> Optional[Notification]:
+        nonlocal failed
+        async with semaphore:
+            try:
+                if item_type == 'movie':
+                    return _movie_notification(await get_movie_details(item_id, refresh=True), today)
+                return _tv_notification(await get_tv_show_details(item_id, refresh=True), today)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500 and e.response.status_code != 429:
+                    # 条目已删除等永久性错误，重试也不会成功，不应阻止检查点前进
+                    logger.info("Skipping %s %s: TMDB answered %s", item_type, item_id, e.response.status_code)
+                    return None
+                logger.warning("Could not check %s %s for updates: %s", item_type, item_id, e)
+                failed += 1
+                return None
+            except Exception as e:
+                logger.warning("Could not check %s %s for updates: %s", item_type, item_id, e)
+                failed += 1
+                return None
+
+    notifications = [notification for notification in await asyncio.gather(*(check(item_id) for item_id in item_ids))
+                     if notification is not None]
+    return notifications, failed
+
+
+async def process_changes(bot: Bot, item_type: str, now: datetime) -> int:
+    """
+    Notify watchers of the movies or TV shows TMDB reports as changed since the checkpoint.
+
+    The changed IDs are intersected with the distinct set of watched IDs, so details are only
+    fetched for items someone is watching. Each notification is a broadcast keyed by item and
+    event, so a release or episode is announced to a user at most once even when the feed
+    reports the item again or the job is interrupted. If the details of any item could not
+    be fetched because of a transient error (5xx, 429, timeouts, open circuit) the checkpoint
+    stays at the start of the period, so the next run checks it again.
+
+    :param bot: Telegram bot
+    :param item_type: 'movie' or 'tv'
+    :param now: Current UTC time, saved as the new checkpoint if every item was checked
+    :return: Number of notifications sent out
+    """
+    since = await get_change_checkpoint(item_type) or now - timedelta(days=1)
+    since = max(since, now - MAX_CHANGES_WINDOW)
+    # 定时任务属于后台流量，让用户的交互请求优先
+    with use_priority(Priority.BACKGROUND):
+        changed = await get_changed_ids(item_type, since.date(), now.date())
+        watched_changed = sorted(changed & await get_watched_item_ids(item_type))
+        notifications, failed = await _find_notifications(item_type, watched_changed, now.date())
+    logger.info("%s changes since %s: %s changed, %s watched, %s to announce, %s failed",
+                item_type, since, len(changed), len(watched_changed), len(notifications), failed)
+
+    for key, message, poster_path in notifications:
+        await start_broadcast(bot, key, message, poster_path)
+    # 已发送的通知不会重复发送；有条目检查失败时，
+    # 检查点停在本次起点，下次重试整个时段
+    if failed:
+        logger.warning("Keeping the %s changes checkpoint at %s until %s failed items can be checked",
+                       item_type, since, failed)
+    await save_change_checkpoint(item_type, since if failed else now)
+    return len(notifications)
+
+
+async def notify_watchlist_changes(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that announces releases and new episodes of watched items."""
+    now = datetime.utcnow()
+    for item_type in ('movie', 'tv'):
+        try:
+            await process_changes(context.bot, item_type, now)
+        except Exception:
+            # 检查点未更新，下次运行时会重新处理这段时间
+            logger.exception("Failed to process %s changes", item_type)
@@ -0,0 +1,120 @@
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, NamedTuple, Optional, Tuple
+
+from config import SEARCH_SNAPSHOT_MAX_USERS, SEARCH_SNAPSHOTS_PER_USER, SEARCH_SNAPSHOT_TTL, SEARCH_PAGE_SIZE, \
+    SEARCH_SNAPSHOT_MAX_RESULTS
+from services.models import SearchHit
+
+
+class SnapshotHit(NamedTuple):
+    """The fields of a search result needed to draw its button."""
+    item_id: int
+    title: str
+    year: str
+    rating: Optional[float]
+
+
+@dataclass
+class SearchSnapshot:
+    query: str
+    movies: List[SnapshotHit]
+    tv_shows: List[SnapshotHit]
+    created_at: float = field(default_factory=time.monotonic)
+    page: int = 0  # Last page shown, restored by "back"
+    stale: bool = False  # Built from cached results while TMDB was unavailable
+
+    @property
+    def key(self) -> str:
+        """Short ID of the query for callback_data, so buttons of older result messages find their own snapshot."""
+        return f"{zlib.crc32(self.query.encode()):08x}"
+
+    @property
+    def page_count(self) -> int:
+        longest = max(len(self.movies), len(self.tv_shows))
+        return max(1, -(-longest // SEARCH_PAGE_SIZE))
+
+    def page_items(self, page: int) -> Tuple[List[SnapshotHit], List[SnapshotHit]]:
+        start = page * SEARCH_PAGE_SIZE
+        return self.movies[start:start + SEARCH_PAGE_SIZE], self.tv_shows[start:start + SEARCH_PAGE_SIZE]
+
+    def find(self, item_type: str, item_id: int) -> Optional[SnapshotHit]:
+        for hit in self.movies if item_type == 'movie' else self.tv_shows:
+            if hit.item_id == item_id:
+                return hit
+        return None
+
+
+def _hits(items: List[SearchHit]) -> List[SnapshotHit]:
+    # 按热度排序后只保留展示所需的字段
+    items = sorted(items, key=lambda x: x.popularity, reverse=True)[:SEARCH_SNAPSHOT_MAX_RESULTS]
+    return [SnapshotHit(item.id, item.title, item.date[:4], item.vote_average) for item in items]
+
+
+def make_snapshot(query: str, movies: List[SearchHit], tv_shows: List[SearchHit]) -> SearchSnapshot:
+    """Rank TMDB search results and keep the fields needed to redraw them."""
+    stale = any(item.stale for item in movies) or any(item.stale for item in tv_shows)
+    return SearchSnapshot(query, _hits(movies), _hits(tv_shows), stale=stale)
+
+
+class SearchSnapshotStore:
+    """
+    Recent search results of each user, so result lists can be redrawn without TMDB.
+
+    Keeps up to per_user snapshots for each of the max_users most recently active users;
+    both levels evict the least recently used entry.
+    """
+
+    def __init__(self, max_users: int = 5000, per_user: int = 3, ttl: float = 600):
+        self.max_users = max_users
+        self.per_user = per_user
+        self.ttl = ttl
+        self._users: "OrderedDict[int, OrderedDict[str, SearchSnapshot]]" = OrderedDict()
+
+    def put(self, user_id: int, snapshot: SearchSnapshot) -> None:
+        snapshots = self._users.setdefault(user_id, OrderedDict())
+        self._users.move_to_end(user_id)
+        snapshots[snapshot.query] = snapshot
+        snapshots.move_to_end(snapshot.query)
+        while len(snapshots) > self.per_user:
+            snapshots.popitem(last=False)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def get(self, user_id: int, query: str) -> Optional[SearchSnapshot]:
+        """The user's snapshot for a query, if it is still fresh and was not built from stale results."""
+        snapshots = self._users.get(user_id)
+        snapshot = snapshots.get(query) if snapshots else None
+        if snapshot is None or snapshot.stale or time.monotonic() - snapshot.created_at > self.ttl:
+            return None
+        self._users.move_to_end(user_id)
+        snapshots.move_to_end(query)
+        return snapshot
+
+    def find(self, user_id: int, key: str) -> Optional[SearchSnapshot]:
+        """The user's snapshot with the given key, however old."""
+        snapshots = self._users.get(user_id)
+        if not snapshots:
+            return None
+        for query, snapshot in snapshots.items():
+            if snapshot.key == key:
+                self._users.move_to_end(user_id)
+                snapshots.move_to_end(query)
+                return snapshot
+        return None
+
+    def latest(self, user_id: int) -> Optional[SearchSnapshot]:
+        """The user's most recently used snapshot, however old."""
+        snapshots = self._users.get(user_id)
+        if not snapshots:
+            return None
+        self._users.move_to_end(user_id)
+        return next(reversed(snapshots.values()))
+
+    def __len__(self) -> int:
+        return sum(len(snapshots) for snapshots in self._users.values())
+
+
+search_snapshots = SearchSnapshotStore(SEARCH_SNAPSHOT_MAX_USERS, SEARCH_SNAPSHOTS_PER_USER, SEARCH_SNAPSHOT_TTL)
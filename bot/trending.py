@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+import httpx
+from telegram.ext import ContextTypes
+
+from config import POSTER_SIZE_BROADCAST, POSTER_SIZE_DETAILS
+from data.database import get_trending_snapshot_row, save_trending_snapshot_row
+from services.models import SearchHit
+from services.movie_service import get_trending_items
+from services.poster_service import get_poster_cache
+from services.rate_limiter import Priority, use_priority
+
+logger = logging.getLogger(__name__)
+
+TIME_WINDOWS = ('day', 'week')
+
+
+@dataclass
+class TrendingSnapshot:
+    time_window: str
+    message: str
+    poster_path: Optional[str]
+    items: List[SearchHit]
+    refreshed_at: datetime
+    # 由 TMDB 不可用时的缓存旧数据构建，只保存在内存中
+    stale: bool = False
+
+
+# 内存中的最新快照，数据库中保存一份供重启后使用
+_snapshots: Dict[str, TrendingSnapshot] = {}
+# 按需构建快照时在后台下载海报，保留引用以免任务被回收
+_poster_prefetches: Set[asyncio.Task] = set()
+
+
+def build_trending_snapshot(time_window: str, trending_items: List[SearchHit],
+                            date: datetime) -> TrendingSnapshot:
+    """
+    Build the trending message for a list of trending movies and TV shows.
+
+    :param time_window: 'day' or 'week'
+    :param trending_items: Items as returned by get_trending_items
+    :param date: Date shown in the message
+    :return: Snapshot holding the Markdown message and the top movie's poster
+    """
+    # 分别获取电影和电视剧
+    movies = [item for item in trending_items if item.item_type == 'movie'][:5]
+    tv_shows = [item for item in trending_items if item.item_type == 'tv'][:5]
+
+    # 创建消息
+    message = f"📅 *Date:* {date.strftime('%Y-%m-%d')}\n"
+    message += f"📊 *Trending:* {time_window.capitalize()}\n"
+    message += "🔗 *GitHub:* [SimonGino/tg-bot-tmdb](https://github.com/SimonGino/tg-bot-tmdb)\n\n"
+
+    message += "🎬 *Trending Movies:*\n"
+    for idx, movie in enumerate(movies, start=1):
+        message += f"{idx}. [{movie.title}] 评分: {movie.vote_average}\n"
+
+    message += "\n📺 *Trending TV Shows:*\n"
+    for idx, tv_show in enumerate(tv_shows, start=1):
+        message += f"{idx}. [{tv_show.title}] 评分: {tv_show.vote_average}\n"
+
+    # 使用排名最高的电影的海报
+    poster_path = movies[0].poster_path if movies else None
+    return TrendingSnapshot(time_window, message, poster_path, trending_items, date,
+                            stale=any(item.stale for item in trending_items))
+
+
+async def _prefetch_posters(trending_items: List[SearchHit]) -> None:
+    """Download the posters shown in the trending message into the poster cache, in the background lane."""
+    poster_cache = get_poster_cache()
+    if poster_cache is None:
+        return
+    shown = [item for item in trending_items if item.item_type == 'movie'][:5] + \
+        [item for item in trending_items if item.item_type == 'tv'][:5]
+    with use_priority(Priority.BACKGROUND):
+        try:
+            await poster_cache.prefetch((item.poster_path for item in shown),
+                                        sizes=(POSTER_SIZE_BROADCAST, POSTER_SIZE_DETAILS))
+        except (OSError, httpx.HTTPError) as e:
+            # 海报只是优化，缓存出错时照常使用快照，发送时再从 TMDB 下载
+            logger.warning("Failed to prefetch trending posters: %s", e)
+
+
+async def refresh_trending_snapshot(time_window: str, refresh: bool = False,
+                                    background: bool = True) -> TrendingSnapshot:
+    """
+    Fetch the trending items of a time window and store the rendered snapshot.
+
+    The posters are downloaded into the poster cache so sending the snapshot does not wait
+    for TMDB's CDN. While TMDB is unavailable the current snapshot is kept rather than
+    replaced by cached, possibly stale items.
+
+    :param time_window: 'day' or 'week'
+    :param refresh: Fetch the items from TMDB instead of the response cache; the periodic
+        job needs this because the cache TTL equals the refresh interval
+    :param background: Run in the background priority lane and wait for the posters; when
+        False the snapshot is built at the caller's priority and the posters are downloaded
+        afterwards, so a user waiting for the first snapshot is not held up
+    :return: The new snapshot
+    """
+    with use_priority(Priority.BACKGROUND) if background else nullcontext():
+        trending_items = await get_trending_items(time_window, refresh)
+    stale = any(item.stale for item in trending_items)
+    if stale and time_window in _snapshots:
+        # TMDB 不可用时返回的是缓存中的旧数据，保留现有快照，下次再试
+        logger.warning("TMDB unavailable, keeping the current %s trending snapshot", time_window)
+        return _snapshots[time_window]
+    snapshot = build_trending_snapshot(time_window, trending_items, datetime.now())
+    if background:
+        await _prefetch_posters(trending_items)
+    else:
+        task = asyncio.create_task(_prefetch_posters(trending_items))
+        _poster_prefetches.add(task)
+        task.add_done_callback(_poster_prefetches.discard)
+    _snapshots[time_window] = snapshot
+    if stale:
+        # 旧数据只在内存中临时使用，不写入数据库
+        return snapshot
+    await save_trending_snapshot_row(time_window, snapshot.message, snapshot.poster_path,
+                                     json.dumps([item.to_dict() for item in snapshot.items], ensure_ascii=False),
+                                     snapshot.refreshed_at)
+    return snapshot
+
+
+async def refresh_trending_snapshots(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that refreshes the snapshots of every time window."""
+    for time_window in TIME_WINDOWS:
+        try:
+            await refresh_trending_snapshot(time_window, refresh=True)
+        except Exception:
+            # 刷新失败时保留旧快照，下次再试
+            logger.exception("Failed to refresh %s trending snapshot", time_window)
+
+
+async def get_trending_snapshot(time_window: str) -> TrendingSnapshot:
+    """
+    Get the latest trending snapshot of a time window.
+
+    Served from memory, or from the database after a restart. Only when no snapshot has
+    ever been stored is it fetched from TMDB on the spot.
+
+    :param time_window: 'day' or 'week'
+    :return: The latest snapshot
+    """
+    snapshot = _snapshots.get(time_window)
+    if snapshot is not None:
+        return snapshot
+    row = await get_trending_snapshot_row(time_window)
+    if row is not None:
+        items = [SearchHit.from_json(item) for item in json.loads(row.items)]
+        snapshot = TrendingSnapshot(row.time_window, row.message, row.poster_path, items, row.refreshed_at)
+        _snapshots[time_window] = snapshot
+        return snapshot
+    logger.info("No %s trending snapshot yet, fetching it now", time_window)
+    return await refresh_trending_snapshot(time_window, background=False)
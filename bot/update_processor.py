@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from services.metrics import COLLECTORS
+
+logger = logging.getLogger(__name__)
+
+HandlerCallback = TypeVar('HandlerCallback', bound=Callable[..., Awaitable[Any]])
+
+# 每个处理函数当前及历史最高的并发数
+_handler_active: Counter = Counter()
+_handler_peak: Counter = Counter()
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently while keeping each chat's updates in order.
+
+    Updates of different chats run in parallel on up to max_concurrent_updates workers.
+    Updates of the same chat (or the same user, for updates without a chat such as
+    inline queries) are serialised in arrival order, so e.g. an "add" tap is handled
+    before the "back" tap that follows it.
+
+    PTB admits at most max_pending updates at a time (default: four per worker); updates
+    waiting for their chat do not occupy a worker, so one busy chat cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: Optional[int] = None):
+        super().__init__(max_pending or max_concurrent_updates * 4)
+        self.workers = max_concurrent_updates
+        self._worker_semaphore = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Counter = Counter()
+        self._active = 0
+        self._waiting = 0
+        self._waiting_for_chat = 0
+        self.processed = 0
+
+    @staticmethod
+    def _sequence_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        self._waiting += 1
+        try:
+            await self._worker_semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            await coroutine
+        finally:
+            self._active -= 1
+            self.processed += 1
+            self._worker_semaphore.release()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._sequence_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        # 同一会话的锁按到达顺序排队（asyncio.Lock 先进先出）
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_waiters[key] += 1
+        self._waiting_for_chat += 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_chat(key)
+            raise
+        finally:
+            self._waiting_for_chat -= 1
+        try:
+            await self._run(coroutine)
+        finally:
+            lock.release()
+            self._release_chat(key)
+
+    def _release_chat(self, key: int) -> None:
+        self._chat_waiters[key] -= 1
+        if not self._chat_waiters[key]:
+            del self._chat_waiters[key]
+            self._chat_locks.pop(key, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def snapshot(self) -> Dict[str, int]:
+        """Current worker usage and backlog of the processor."""
+        return {
+            'workers': self.workers,
+            'active': self._active,
+            'waiting_for_worker': self._waiting,
+            'waiting_for_chat': self._waiting_for_chat,
+            'busy_chats': len(self._chat_locks),
+            'processed': self.processed,
+        }
+
+
+def track_concurrency(callback: HandlerCallback) -> HandlerCallback:
+    """Decorate a handler callback to record how many of its calls run at the same time."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        _handler_active[name] += 1
+        _handler_peak[name] = max(_handler_peak[name], _handler_active[name])
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            _handler_active[name] -= 1
+
+    return wrapper  # type: ignore[return-value]
+
+
+def get_handler_concurrency() -> Dict[str, Dict[str, int]]:
+    """Current and peak concurrent calls per tracked handler."""
+    return {name: {'active': _handler_active[name], 'peak': peak} for name, peak in _handler_peak.items()}
+
+
+def _collect_concurrency() -> List[Tuple[str, float]]:
+    """Per-handler concurrency for the /metrics endpoint."""
+    samples = []
+    for name, stats in get_handler_concurrency().items():
+        samples += [(f'handler_concurrency_active{{handler="{name}"}}', stats['active']),
+                    (f'handler_concurrency_peak{{handler="{name}"}}', stats['peak'])]
+    return samples
+
+
+COLLECTORS.append(_collect_concurrency)
+
+
+def get_update_stats(application: Application) -> Dict[str, Any]:
+    """
+    Queue depth and concurrency of update processing.
+
+    :param application: Running application
+    :return: Updates waiting in the update queue, processor usage and per-handler concurrency
+    """
+    processor = application.update_processor
+    return {
+        'queue_depth': application.update_queue.qsize(),
+        'processor': processor.snapshot() if isinstance(processor, PerChatUpdateProcessor) else {},
+        'handlers': get_handler_concurrency(),
+    }
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from telegram import Message
+from telegram.error import BadRequest
+
+from config import POSTER_SIZE_DETAILS, POSTER_FILE_ID_CACHE_SIZE
+from data.database import get_poster_file_id, save_poster_file_id, delete_poster_file_id
+from services.models import get_poster_url
+from services.poster_service import get_poster_cache
+
+logger = logging.getLogger(__name__)
+
+# '<size><poster_path>' -> Telegram file_id，数据库中映射的 LRU 副本；未上传过的海报不缓存
+_file_ids: "OrderedDict[str, str]" = OrderedDict()
+# 同一海报首次上传时只让一个请求上传，其余等待复用 file_id
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _cache_file_id(key: str, file_id: str) -> None:
+    _file_ids[key] = file_id
+    _file_ids.move_to_end(key)
+    while len(_file_ids) > POSTER_FILE_ID_CACHE_SIZE:
+        _file_ids.popitem(last=False)
+
+
+async def _cached_file_id(key: str) -> Optional[str]:
+    file_id = _file_ids.get(key)
+    if file_id is not None:
+        _file_ids.move_to_end(key)
+        return file_id
+    file_id = await get_poster_file_id(key)
+    if file_id:
+        _cache_file_id(key, file_id)
+    return file_id
+
+
+async def _forget_file_id(key: str) -> None:
+    _file_ids.pop(key, None)
+    await delete_poster_file_id(key)
+
+
+async def _remember_file_id(key: str, message: Message) -> None:
+    if message and message.photo:
+        file_id = message.photo[-1].file_id
+        _cache_file_id(key, file_id)
+        await save_poster_file_id(key, file_id)
+
+
+async def _upload(send_photo: Callable[..., Awaitable[Message]], poster_path: str, size: str,
+                  **kwargs: Any) -> Message:
+    photo = get_poster_url(poster_path, size)
+    poster_cache = get_poster_cache()
+    if poster_cache is not None:
+        try:
+            photo = await poster_cache.get(poster_path, size)
+        except httpx.HTTPError as e:
+            logger.warning("Poster cache could not fetch %s (%s), sending URL instead", poster_path, e)
+    message = await send_photo(photo=photo, **kwargs)
+    await _remember_file_id(f"{size}{poster_path}", message)
+    return message
+
+
+async def send_poster(send_photo: Callable[..., Awaitable[Message]], poster_path: str,
+                      size: str = POSTER_SIZE_DETAILS, **kwargs: Any) -> Message:
+    """
+    Send a TMDB poster, reusing the Telegram file_id from an earlier upload when possible.
+
+    The first send of a poster uploads it from the local poster cache (or passes its URL
+    when the cache is disabled); the resulting file_id is stored and used for every later
+    send. A file_id Telegram rejects is dropped and the poster is uploaded again.
+
+    :param send_photo: Bound send method, e.g. message.reply_photo or partial(bot.send_photo, chat_id=...)
+    :param poster_path: TMDB poster path
+    :param size: TMDB image size variant to send
+    :param kwargs: Extra arguments for send_photo, such as caption or reply_markup
+    :return: The sent message
+    """
+    key = f"{size}{poster_path}"
+    file_id = await _cached_file_id(key)
+    if not file_id:
+        lock = _upload_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                file_id = _file_ids.get(key)
+                if not file_id:
+                    return await _upload(send_photo, poster_path, size, **kwargs)
+        finally:
+            # 等待中的请求仍持有这把锁的引用，之后到达的请求会在 _file_ids 中找到 file_id
+            if _upload_locks.get(key) is lock:
+                del _upload_locks[key]
+
+    try:
+        return await send_photo(photo=file_id, **kwargs)
+    except BadRequest as e:
+        if 'file' not in str(e).lower():
+            raise  # Not a problem with the cached file, e.g. the chat is gone
+        logger.warning("Cached file_id for %s rejected (%s), re-uploading", key, e)
+        await _forget_file_id(key)
+        return await _upload(send_photo, poster_path, size, **kwargs)
@@ -0,0 +1,168 @@
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from services.metrics import render_prometheus
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30
+
+Request = Tuple[str, str, Dict[str, str], bytes]  # method, target (path and query), headers (lower-case names), body
+Response = Tuple[int, str, bytes]  # status, content type, body
+RouteHandler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPServer:
+    """
+    Minimal asyncio HTTP/1.1 server for the webhook and internal endpoints.
+
+    Supports keep-alive and Content-Length bodies, which is all Telegram and
+    monitoring scrapers need, without pulling in a web framework.
+    """
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._routes: Dict[Tuple[str, str], RouteHandler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._busy: Set[asyncio.Task] = set()  # Connections with a request being handled
+
+    def add_route(self, method: str, path: str, handler: RouteHandler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    @property
+    def bound_port(self) -> int:
+        """The port actually listened on (useful when started with port 0)."""
+        return self._server.sockets[0].getsockname()[1] if self._server else self.port
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("HTTP server listening on %s:%s", self.listen, self.bound_port)
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Stop accepting connections and give in-flight requests time to finish."""
+        if self._server is None:
+            return
+        self._server.close()
+        for task in self._connections - self._busy:
+            task.cancel()  # Idle keep-alive connections
+        if self._busy:
+            _, pending = await asyncio.wait(self._busy, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                if request is None:
+                    break
+                self._busy.add(task)
+                status, content_type, body = await self._dispatch(request)
+                keep_alive = request[2].get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {int(status)} {HTTPStatus(status).phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+                self._busy.discard(task)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Closed by stop()
+        finally:
+            self._connections.discard(task)
+            self._busy.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    async def _dispatch(self, request: Request) -> Response:
+        method, path = request[0], request[1].split('?', 1)[0]
+        handler = self._routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self._routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, 'text/plain', b'method not allowed'
+            return HTTPStatus.NOT_FOUND, 'text/plain', b'not found'
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception("Error handling %s %s", method, path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, 'text/plain', b'internal error'
+
+
+def add_webhook_route(server: HTTPServer, application: Application, url_path: str, secret_token: str) -> None:
+    """
+    Accept Telegram updates POSTed to url_path and queue them on the application.
+
+    :param server: HTTP server to register the route on
+    :param application: Application whose update_queue receives the updates
+    :param url_path: Path Telegram posts to, e.g. '/telegram'
+    :param secret_token: Expected X-Telegram-Bot-Api-Secret-Token header
+    :raises ValueError: If secret_token is empty
+    """
+    if not secret_token:
+        raise ValueError("A webhook secret token is required")
+
+    async def handle_update(request: Request) -> Response:
+        _, _, headers, body = request
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, '').encode(),
+                                   secret_token.encode()):
+            return HTTPStatus.FORBIDDEN, 'text/plain', b'forbidden'
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            return HTTPStatus.BAD_REQUEST, 'text/plain', b'invalid update'
+        if update is None:
+            return HTTPStatus.BAD_REQUEST, 'text/plain', b'invalid update'
+        await application.update_queue.put(update)
+        return HTTPStatus.OK, 'text/plain', b'ok'
+
+    async def health(request: Request) -> Response:
+        return HTTPStatus.OK, 'text/plain', b'ok'
+
+    server.add_route('POST', url_path, handle_update)
+    server.add_route('GET', '/healthz', health)
+
+
+def add_metrics_route(server: HTTPServer, url_path: str = '/metrics') -> None:
+    """Expose all metrics in the Prometheus text format at url_path."""
+    async def metrics(request: Request) -> Response:
+        return HTTPStatus.OK, 'text/plain; version=0.0.4', render_prometheus().encode()
+
+    server.add_route('GET', url_path, metrics)
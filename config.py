@@ -8,7 +8,128 @@ TMDB_API_KEY = os.getenv('TMDB_API_KEY')
 
 # Database configuration
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./movie_bot.db')
+# Async driver URL used at runtime; derived from DATABASE_URL for SQLite
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', DATABASE_URL.replace('sqlite://', 'sqlite+aiosqlite://', 1))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))  # milliseconds
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '16384'))
 
 # Scheduler configuration
 WEEKLY_UPDATE_DAY = 'monday'
-WEEKLY_UPDATE_TIME = '09:00'
\ No newline at end of file
+WEEKLY_UPDATE_TIME = '09:00'
+
+# TMDB client configuration
+TMDB_BASE_URL = os.getenv('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+TMDB_TIMEOUT = float(os.getenv('TMDB_TIMEOUT', '10'))
+TMDB_CONNECT_TIMEOUT = float(os.getenv('TMDB_CONNECT_TIMEOUT', '5'))
+TMDB_MAX_CONNECTIONS = int(os.getenv('TMDB_MAX_CONNECTIONS', '20'))
+TMDB_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('TMDB_MAX_KEEPALIVE_CONNECTIONS', '10'))
+
+# Response cache configuration (TTLs in seconds)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '2048'))
+CACHE_STALE_TTL = int(os.getenv('CACHE_STALE_TTL', '86400'))
+CACHE_TTL_DETAILS = int(os.getenv('CACHE_TTL_DETAILS', '21600'))
+CACHE_TTL_SEARCH = int(os.getenv('CACHE_TTL_SEARCH', '600'))
+CACHE_TTL_TRENDING = int(os.getenv('CACHE_TTL_TRENDING', '1800'))
+# Path of the on-disk second cache tier; leave empty to keep the cache in memory only
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', '')
+
+# TMDB rate limiting (requests per second)
+TMDB_RATE_LIMIT = float(os.getenv('TMDB_RATE_LIMIT', '35'))
+TMDB_RATE_BURST = int(os.getenv('TMDB_RATE_BURST', '20'))
+TMDB_MIN_RATE_LIMIT = float(os.getenv('TMDB_MIN_RATE_LIMIT', '2'))
+TMDB_MAX_RETRIES = int(os.getenv('TMDB_MAX_RETRIES', '3'))
+
+# Per-endpoint circuit breaker: open after this many consecutive failures (errors, timeouts,
+# 5xx, exhausted 429 retries), probe again after the reset timeout (seconds)
+TMDB_BREAKER_FAILURE_THRESHOLD = int(os.getenv('TMDB_BREAKER_FAILURE_THRESHOLD', '5'))
+TMDB_BREAKER_RESET_TIMEOUT = float(os.getenv('TMDB_BREAKER_RESET_TIMEOUT', '30'))
+TMDB_BREAKER_HALF_OPEN_CALLS = int(os.getenv('TMDB_BREAKER_HALF_OPEN_CALLS', '1'))
+
+# Use TMDB's /search/multi endpoint instead of parallel movie and TV searches
+TMDB_USE_SEARCH_MULTI = os.getenv('TMDB_USE_SEARCH_MULTI', 'false').lower() == 'true'
+
+# Broadcast configuration
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+# Telegram allows roughly 30 messages per second across all chats
+BROADCAST_RATE_LIMIT = float(os.getenv('BROADCAST_RATE_LIMIT', '25'))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv('BROADCAST_MAX_ATTEMPTS', '5'))
+BROADCAST_PROGRESS_BATCH = int(os.getenv('BROADCAST_PROGRESS_BATCH', '20'))
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '500'))
+# Split broadcasts across processes: each one handles user_id % BROADCAST_SHARD_COUNT == BROADCAST_SHARD_INDEX
+BROADCAST_SHARD_INDEX = int(os.getenv('BROADCAST_SHARD_INDEX', '0'))
+BROADCAST_SHARD_COUNT = int(os.getenv('BROADCAST_SHARD_COUNT', '1'))
+
+# Poster cache configuration
+TMDB_IMAGE_BASE_URL = os.getenv('TMDB_IMAGE_BASE_URL', 'https://image.tmdb.org/t/p')
+# Directory of the on-disk poster cache; leave empty to let Telegram fetch posters from TMDB directly
+POSTER_CACHE_DIR = os.getenv('POSTER_CACHE_DIR', './poster_cache')
+POSTER_CACHE_MAX_BYTES = int(os.getenv('POSTER_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+POSTER_SIZE_DETAILS = os.getenv('POSTER_SIZE_DETAILS', 'w500')
+POSTER_SIZE_BROADCAST = os.getenv('POSTER_SIZE_BROADCAST', 'w342')
+# Telegram file_ids of uploaded posters kept in memory (the database holds all of them)
+POSTER_FILE_ID_CACHE_SIZE = int(os.getenv('POSTER_FILE_ID_CACHE_SIZE', '10000'))
+
+# Write-behind queue for subscriber and watchlist inserts
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.005'))  # seconds
+WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', '200'))
+# Number of users whose watchlist membership is kept in memory
+WATCHLIST_INDEX_MAX_USERS = int(os.getenv('WATCHLIST_INDEX_MAX_USERS', '10000'))
+WATCHLIST_PAGE_SIZE = int(os.getenv('WATCHLIST_PAGE_SIZE', '10'))
+SUBSCRIBER_CHUNK_SIZE = int(os.getenv('SUBSCRIBER_CHUNK_SIZE', '500'))
+
+# Number of updates handled at the same time; updates of one chat are always handled in order
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '16'))
+
+# Local full-text index of titles seen from TMDB; leave the path empty to always search TMDB
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', './search_index.db')
+SEARCH_INDEX_MAX_ENTRIES = int(os.getenv('SEARCH_INDEX_MAX_ENTRIES', '100000'))
+# Minimum similarity (0-1) for a fuzzy title match
+SEARCH_FUZZY_THRESHOLD = float(os.getenv('SEARCH_FUZZY_THRESHOLD', '0.6'))
+# Ask TMDB as well when the local index has fewer results than this
+SEARCH_LOCAL_MIN_RESULTS = int(os.getenv('SEARCH_LOCAL_MIN_RESULTS', '5'))
+
+# Recent search results kept per user so "back" and paging do not hit TMDB
+SEARCH_SNAPSHOT_MAX_USERS = int(os.getenv('SEARCH_SNAPSHOT_MAX_USERS', '5000'))
+SEARCH_SNAPSHOTS_PER_USER = int(os.getenv('SEARCH_SNAPSHOTS_PER_USER', '3'))
+SEARCH_SNAPSHOT_TTL = int(os.getenv('SEARCH_SNAPSHOT_TTL', str(CACHE_TTL_SEARCH)))
+SEARCH_SNAPSHOT_MAX_RESULTS = int(os.getenv('SEARCH_SNAPSHOT_MAX_RESULTS', '20'))  # Per type
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5'))  # Results per type on one page
+# Details of this many top movies and TV shows on a result page are loaded in the background; 0 disables
+DETAIL_PREFETCH_COUNT = int(os.getenv('DETAIL_PREFETCH_COUNT', '2'))
+
+# Inline mode: wait this long (seconds) after the last keystroke before searching
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', '0.35'))
+# How long Telegram may cache an inline answer (seconds)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+INLINE_RESULT_CACHE_SIZE = int(os.getenv('INLINE_RESULT_CACHE_SIZE', '1024'))
+INLINE_RESULT_CACHE_TTL = int(os.getenv('INLINE_RESULT_CACHE_TTL', '600'))
+INLINE_MAX_RESULTS = int(os.getenv('INLINE_MAX_RESULTS', '20'))
+
+# Seconds between background refreshes of the /trending snapshots
+TRENDING_REFRESH_INTERVAL = int(os.getenv('TRENDING_REFRESH_INTERVAL', '1800'))
+
+# Watchlist notifications from TMDB's /changes feed
+WATCHLIST_NOTIFY_INTERVAL = int(os.getenv('WATCHLIST_NOTIFY_INTERVAL', '3600'))  # seconds
+# Releases and episodes older than this many days are not announced
+WATCHLIST_NOTIFY_RECENT_DAYS = int(os.getenv('WATCHLIST_NOTIFY_RECENT_DAYS', '7'))
+WATCHLIST_NOTIFY_CONCURRENCY = int(os.getenv('WATCHLIST_NOTIFY_CONCURRENCY', '4'))
+
+# Metrics: latency histograms and counters, served in Prometheus format on METRICS_PORT
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))  # 0 disables the endpoint
+# Comma-separated Telegram user IDs allowed to use /stats
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Update delivery: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Public base URL Telegram should post to, e.g. https://bot.example.com; leave empty to register the webhook yourself
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Required unless WEBHOOK_URL is set, in which case a random token is generated for each run
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
@@ -1,18 +1,72 @@
+import asyncio
+import logging
+import sys
+from collections import OrderedDict
 from datetime import datetime
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import create_engine, event, select, delete, update, text, tuple_, Column, Integer, String, DateTime, \
+    Text, UniqueConstraint, Index, Table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from config import DATABASE_URL
+from config import DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, \
+    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_BATCH, \
+    WATCHLIST_INDEX_MAX_USERS, WATCHLIST_PAGE_SIZE, SUBSCRIBER_CHUNK_SIZE
+from services.metrics import COLLECTORS, instrument_db
+
+logger = logging.getLogger(__name__)
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """Connection pool options for the given database URL."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite':
+        if parsed.database in (None, '', ':memory:'):
+            return {}  # In-memory databases live on a single connection
+        return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+                "connect_args": {"check_same_thread": False}}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_pre_ping": True}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Tune every new SQLite connection: WAL journal, relaxed fsync, busy timeout and a larger page cache."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+# 同步引擎只用于建表和迁移，运行时的查询都走异步引擎
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 Session = sessionmaker(bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+if engine.dialect.name == 'sqlite':
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+if async_engine.dialect.name == 'sqlite':
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 
 
 class WatchlistItem(Base):
     __tablename__ = 'watchlist'
+    __table_args__ = (
+        # 唯一索引同时覆盖按 user_id 以及 (user_id, item_id) 的查询
+        Index('uq_watchlist_user_item', 'user_id', 'item_id', 'item_type', unique=True),
+        Index('ix_watchlist_user_added', 'user_id', 'added_date', 'id'),
+        # 按条目查找关注者，以及获取去重后的被关注条目
+        Index('ix_watchlist_item_user', 'item_type', 'item_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)
@@ -28,9 +82,283 @@ class Subscriber(Base):
     user_id = Column(Integer, nullable=False, unique=True)
 
 
-Base.metadata.create_all(engine)
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False, unique=True)  # e.g. 'weekly_trending:2024-08-25'
+    text = Column(Text, nullable=False)
+    photo = Column(String, nullable=True)  # TMDB poster path
+    status = Column(String, nullable=False, default='running')  # 'running' or 'done'
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BroadcastDelivery(Base):
+    __tablename__ = 'broadcast_deliveries'
+    __table_args__ = (UniqueConstraint('broadcast_id', 'user_id', name='uq_broadcast_delivery'),)
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)  # 'sent', 'failed' or 'blocked'
+    delivered_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PosterFileId(Base):
+    __tablename__ = 'poster_file_ids'
+
+    poster_path = Column(String, primary_key=True)  # TMDB size and poster_path, e.g. 'w500/abc.jpg'
+    file_id = Column(String, nullable=False)  # Telegram file_id of the uploaded photo
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class TrendingSnapshotRow(Base):
+    __tablename__ = 'trending_snapshots'
+
+    time_window = Column(String, primary_key=True)  # 'day' or 'week'
+    message = Column(Text, nullable=False)  # Rendered Markdown message
+    poster_path = Column(String, nullable=True)  # TMDB poster path of the top movie
+    items = Column(Text, nullable=False)  # JSON list of the trending items
+    refreshed_at = Column(DateTime, nullable=False)
+
+
+class ChangeCheckpoint(Base):
+    __tablename__ = 'change_checkpoints'
+
+    feed = Column(String, primary_key=True)  # 'movie' or 'tv'
+    checked_at = Column(DateTime, nullable=False)  # End of the last processed /changes window (UTC)
+
+
+def migrate_database() -> None:
+    """
+    Create missing tables and bring existing databases up to the current schema.
+
+    create_all only creates tables that do not exist yet, so indexes added to existing
+    tables are created here explicitly. Duplicate watchlist rows left behind by the old
+    check-then-insert logic are removed (keeping the oldest) before the unique index is built.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        removed = connection.execute(text(
+            "DELETE FROM watchlist WHERE id NOT IN ("
+            "SELECT MIN(id) FROM watchlist GROUP BY user_id, item_id, item_type)"
+        )).rowcount
+        if removed:
+            logger.info("Removed %s duplicate watchlist rows", removed)
+        for index in WatchlistItem.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+
+migrate_database()
+
+
+def _insert_ignore(table):
+    """INSERT ... ON CONFLICT DO NOTHING for the configured database."""
+    dialect = postgresql if async_engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table).on_conflict_do_nothing()
+
+
+class WriteBehindQueue:
+    """
+    Group small inserts into batched upserts committed in a single transaction.
+
+    Writes are buffered for at most flush_interval seconds or until max_batch rows are
+    pending, then written with INSERT ... ON CONFLICT DO NOTHING per table. Callers await
+    the commit of the batch holding their row, so a write that returned is durable and
+    visible to every later read.
+    """
+
+    def __init__(self, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.batches = 0
+        self.rows = 0
+        self._pending: List[Tuple[Table, Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._flushes: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, table: Table, row: Dict[str, Any]) -> bool:
+        """
+        Queue a row for insertion and wait until its batch is committed.
+
+        :param table: Target table
+        :param row: Column values
+        :return: True if the row was inserted, False if it conflicted with an existing row
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((table, row, future))
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self) -> None:
+        """Write all pending rows now."""
+        async with self._flush_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                inserted = await self._write(batch)
+            except Exception as e:
+                logger.exception("Write-behind flush of %s rows failed", len(batch))
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.batches += 1
+            self.rows += len(batch)
+            for table, row, future in batch:
+                key = tuple(row[column.name] for column in _conflict_columns(table))
+                # 同一批次里重复的行只有第一行算作新插入
+                added = key in inserted[table]
+                inserted[table].discard(key)
+                if not future.done():
+                    future.set_result(added)
+
+    @staticmethod
+    async def _write(batch: List[Tuple[Table, Dict[str, Any], asyncio.Future]]) -> Dict[Table, Set[tuple]]:
+        rows_by_table: Dict[Table, List[Dict[str, Any]]] = {}
+        for table, row, _ in batch:
+            rows_by_table.setdefault(table, []).append(row)
+        inserted: Dict[Table, Set[tuple]] = {}
+        async with AsyncSession() as session:
+            for table, rows in rows_by_table.items():
+                columns = _conflict_columns(table)
+                result = await session.execute(_insert_ignore(table).returning(*columns), rows)
+                inserted[table] = {tuple(row) for row in result}
+            await session.commit()
+        return inserted
+
+    async def close(self) -> None:
+        """Flush the remaining rows, e.g. on shutdown."""
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+def _conflict_columns(table: Table) -> List[Column]:
+    """Columns identifying a row for the unique constraint an upsert can conflict on."""
+    if table is WatchlistItem.__table__:
+        return [table.c.user_id, table.c.item_id, table.c.item_type]
+    return [table.c.user_id]
+
+
+write_queue = WriteBehindQueue()
+COLLECTORS.append(lambda: [("db_write_queue_depth", len(write_queue))])
+
+
+class WatchlistIndex:
+    """
+    In-memory set of (item_type, item_id) per user for O(1) membership checks.
+
+    A user's set is loaded from the database on first use and kept up to date by the
+    watchlist write functions. At most max_users sets are kept; the least recently used
+    user is dropped first.
+    """
+
+    def __init__(self, max_users: int = WATCHLIST_INDEX_MAX_USERS):
+        self.max_users = max_users
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._users: "OrderedDict[int, Set[Tuple[str, int]]]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._changed_while_loading: Set[int] = set()
+
+    async def _load(self, user_id: int) -> Set[Tuple[str, int]]:
+        self.loads += 1
+        async with AsyncSession() as session:
+            result = await session.execute(
+                select(WatchlistItem.item_type, WatchlistItem.item_id).filter_by(user_id=user_id)
+            )
+            items = {(item_type, item_id) for item_type, item_id in result}
+        # 加载期间有写入时不缓存，避免装入过期的集合
+        if user_id not in self._changed_while_loading:
+            self._users[user_id] = items
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+        return items
+
+    async def items(self, user_id: int) -> Set[Tuple[str, int]]:
+        """Get a user's (item_type, item_id) set, loading it if necessary."""
+        items = self._users.get(user_id)
+        if items is not None:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return items
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = future
+
+            def done(_) -> None:
+                self._loading.pop(user_id, None)
+                self._changed_while_loading.discard(user_id)
+
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def contains(self, user_id: int, item_id: int, item_type: str) -> bool:
+        return (item_type, item_id) in await self.items(user_id)
 
-def is_in_watchlist(user_id: int, item_id: int, item_type: str) -> bool:
+    def _changed(self, user_id: int) -> Optional[Set[Tuple[str, int]]]:
+        if user_id in self._loading:
+            self._changed_while_loading.add(user_id)
+        return self._users.get(user_id)
+
+    def add(self, user_id: int, item_id: int, item_type: str) -> None:
+        items = self._changed(user_id)
+        if items is not None:
+            items.add((item_type, item_id))
+
+    def discard(self, user_id: int, item_id: int, item_type: str) -> None:
+        items = self._changed(user_id)
+        if items is not None:
+            items.discard((item_type, item_id))
+
+    def stats(self) -> Dict[str, float]:
+        """Hit rate and approximate memory footprint of the index."""
+        lookups = self.hits + self.loads
+        memory = sys.getsizeof(self._users) + sum(
+            sys.getsizeof(items) + sum(sys.getsizeof(item) for item in items) for items in self._users.values()
+        )
+        return {
+            "users": len(self._users),
+            "items": sum(len(items) for items in self._users.values()),
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": memory,
+        }
+
+
+watchlist_index = WatchlistIndex()
+COLLECTORS.append(lambda: [(f"watchlist_index_{name}", value) for name, value in watchlist_index.stats().items()])
+
+
+@instrument_db
+async def is_in_watchlist(user_id: int, item_id: int, item_type: str) -> bool:
     """
         Check if an item is already in the user's watchlist.
 
@@ -39,16 +367,10 @@ def is_in_watchlist(user_id: int, item_id: int, item_type: str) -> bool:
         :param item_type: 'movie' or 'tv'
         :return: True if the item is in the watchlist, False otherwise
         """
-    session = Session()
-    item = session.query(WatchlistItem).filter_by(
-        user_id=user_id,
-        item_id=item_id,
-        item_type=item_type
-    ).first()
-    session.close()
-    return item is not None
+    return await watchlist_index.contains(user_id, item_id, item_type)
 
-def add_to_watchlist(user_id: int, item_id: int, item_type: str, title: str) -> None:
+@instrument_db
+async def add_to_watchlist(user_id: int, item_id: int, item_type: str, title: str) -> bool:
     """
     Add an item to the user's watchlist.
 
@@ -56,28 +378,72 @@ def add_to_watchlist(user_id: int, item_id: int, item_type: str, title: str) ->
     :param item_id: TMDB movie or TV show ID
     :param item_type: 'movie' or 'tv'
     :param title: Title of the movie or TV show
+    :return: True if the item was added, False if it was already in the watchlist
     """
-    session = Session()
-    watchlist_item = WatchlistItem(user_id=user_id, item_id=item_id, item_type=item_type, title=title)
-    session.add(watchlist_item)
-    session.commit()
-    session.close()
+    added = await write_queue.submit(WatchlistItem.__table__, {
+        "user_id": user_id, "item_id": item_id, "item_type": item_type, "title": title,
+        "added_date": datetime.utcnow()
+    })
+    watchlist_index.add(user_id, item_id, item_type)
+    return added
 
 
-def get_watchlist(user_id: int) -> list:
+@instrument_db
+async def get_watchlist(user_id: int) -> list:
     """
     Get the watchlist for a specific user.
 
     :param user_id: Telegram user ID
     :return: List of watchlist items
     """
-    session = Session()
-    watchlist = session.query(WatchlistItem).filter_by(user_id=user_id).all()
-    session.close()
-    return watchlist
+    async with AsyncSession() as session:
+        result = await session.scalars(select(WatchlistItem).filter_by(user_id=user_id))
+        return list(result)
+
+
+class WatchlistPage(NamedTuple):
+    items: list  # Rows with id, item_id, item_type, title and added_date
+    has_prev: bool
+    has_next: bool
 
 
-def remove_from_watchlist(user_id: int, item_id: int) -> bool:
+@instrument_db
+async def get_watchlist_page(user_id: int, cursor: Optional[Tuple[datetime, int]] = None, backwards: bool = False,
+                             limit: int = WATCHLIST_PAGE_SIZE) -> WatchlistPage:
+    """
+    Get one page of a user's watchlist, ordered by the date items were added.
+
+    Uses keyset pagination on (added_date, id), so every page is a single range scan of
+    the (user_id, added_date, id) index no matter how deep it is.
+
+    :param user_id: Telegram user ID
+    :param cursor: (added_date, id) of the last item of the previous page, or of the first
+        item of the next page when paging backwards; None for the first page
+    :param backwards: Fetch the page before the cursor instead of the one after it
+    :param limit: Page size
+    :return: The page and whether there are pages before and after it
+    """
+    key = tuple_(WatchlistItem.added_date, WatchlistItem.id)
+    query = select(WatchlistItem.id, WatchlistItem.item_id, WatchlistItem.item_type, WatchlistItem.title,
+                   WatchlistItem.added_date).filter_by(user_id=user_id)
+    if backwards:
+        query = query.where(key < tuple_(*cursor)).order_by(WatchlistItem.added_date.desc(), WatchlistItem.id.desc())
+    else:
+        if cursor is not None:
+            query = query.where(key > tuple_(*cursor))
+        query = query.order_by(WatchlistItem.added_date, WatchlistItem.id)
+
+    async with AsyncSession() as session:
+        rows = list(await session.execute(query.limit(limit + 1)))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        return WatchlistPage(rows[::-1], has_more, True)
+    return WatchlistPage(rows, cursor is not None, has_more)
+
+
+@instrument_db
+async def remove_from_watchlist(user_id: int, item_id: int) -> bool:
     """
     Remove an item from the user's watchlist.
 
@@ -85,37 +451,307 @@ def remove_from_watchlist(user_id: int, item_id: int) -> bool:
     :param item_id: TMDB movie or TV show ID
     :return: True if item was removed, False if not found
     """
-    session = Session()
-    item = session.query(WatchlistItem).filter_by(user_id=user_id, item_id=item_id).first()
-    if item:
-        session.delete(item)
-        session.commit()
-        session.close()
-        return True
-    session.close()
-    return False
+    async with AsyncSession() as session:
+        row = (await session.execute(
+            select(WatchlistItem.id, WatchlistItem.item_type).filter_by(user_id=user_id, item_id=item_id).limit(1)
+        )).first()
+        if row is None:
+            return False
+        await session.execute(delete(WatchlistItem).filter_by(id=row.id))
+        await session.commit()
+    watchlist_index.discard(user_id, item_id, row.item_type)
+    return True
 
-def add_subscriber(user_id: int) -> None:
+@instrument_db
+async def add_subscriber(user_id: int) -> None:
     """
     Add a user to the subscribers list if not already subscribed.
 
     :param user_id: Telegram user ID
     """
-    session = Session()
-    existing_subscriber = session.query(Subscriber).filter_by(user_id=user_id).first()
-    if not existing_subscriber:
-        subscriber = Subscriber(user_id=user_id)
-        session.add(subscriber)
-        session.commit()
-    session.close()
+    await write_queue.submit(Subscriber.__table__, {"user_id": user_id})
 
-def get_all_subscribers() -> list:
+@instrument_db
+async def get_all_subscribers() -> list:
     """
     Get all subscribers' user IDs.
 
     :return: List of user IDs
     """
-    session = Session()
-    subscribers = session.query(Subscriber).all()
-    session.close()
-    return [subscriber.user_id for subscriber in subscribers]
\ No newline at end of file
+    async with AsyncSession() as session:
+        result = await session.scalars(select(Subscriber.user_id))
+        return list(result)
+
+
+async def iter_subscriber_ids(chunk_size: int = SUBSCRIBER_CHUNK_SIZE, shard_index: int = 0,
+                              shard_count: int = 1) -> AsyncIterator[List[int]]:
+    """
+    Stream subscribers' user IDs in chunks, ordered by primary key.
+
+    Each chunk is a separate keyset query (id > last seen id), so no connection is held
+    while the caller processes a chunk and memory stays bounded by chunk_size. With
+    shard_count > 1 only users with user_id % shard_count == shard_index are returned,
+    letting several processes split one broadcast without overlap.
+
+    :param chunk_size: Maximum number of IDs per chunk
+    :param shard_index: Shard to return, from 0 to shard_count - 1
+    :param shard_count: Total number of shards
+    :return: Async iterator over lists of user IDs
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}")
+    last_id = 0
+    while True:
+        query = select(Subscriber.id, Subscriber.user_id).where(Subscriber.id > last_id)
+        if shard_count > 1:
+            query = query.where(Subscriber.user_id % shard_count == shard_index)
+        async with AsyncSession() as session:
+            rows = list(await session.execute(query.order_by(Subscriber.id).limit(chunk_size)))
+        if not rows:
+            return
+        yield [row.user_id for row in rows]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+@instrument_db
+async def get_watched_item_ids(item_type: str) -> Set[int]:
+    """
+    Get the distinct IDs of the items of one type that are on anyone's watchlist.
+
+    :param item_type: 'movie' or 'tv'
+    :return: Set of TMDB IDs
+    """
+    async with AsyncSession() as session:
+        result = await session.scalars(select(WatchlistItem.item_id).filter_by(item_type=item_type).distinct())
+        return set(result)
+
+
+async def iter_watcher_ids(item_type: str, item_id: int, chunk_size: int = SUBSCRIBER_CHUNK_SIZE,
+                           shard_index: int = 0, shard_count: int = 1) -> AsyncIterator[List[int]]:
+    """
+    Stream the IDs of the users who have an item on their watchlist, in chunks.
+
+    Works like iter_subscriber_ids, with keyset pagination on user_id over the
+    (item_type, item_id, user_id) index.
+
+    :param item_type: 'movie' or 'tv'
+    :param item_id: TMDB ID
+    :param chunk_size: Maximum number of IDs per chunk
+    :param shard_index: Shard to return, from 0 to shard_count - 1
+    :param shard_count: Total number of shards
+    :return: Async iterator over lists of user IDs
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}")
+    last_user_id = None
+    while True:
+        query = select(WatchlistItem.user_id).filter_by(item_type=item_type, item_id=item_id)
+        if last_user_id is not None:
+            query = query.where(WatchlistItem.user_id > last_user_id)
+        if shard_count > 1:
+            query = query.where(WatchlistItem.user_id % shard_count == shard_index)
+        async with AsyncSession() as session:
+            user_ids = list(await session.scalars(query.order_by(WatchlistItem.user_id).limit(chunk_size)))
+        if not user_ids:
+            return
+        yield user_ids
+        if len(user_ids) < chunk_size:
+            return
+        last_user_id = user_ids[-1]
+
+
+@instrument_db
+async def get_change_checkpoint(feed: str) -> Optional[datetime]:
+    """
+    Get the time up to which a TMDB /changes feed has been processed.
+
+    :param feed: 'movie' or 'tv'
+    :return: UTC time, or None if the feed has never been processed
+    """
+    async with AsyncSession() as session:
+        return await session.scalar(select(ChangeCheckpoint.checked_at).filter_by(feed=feed))
+
+
+@instrument_db
+async def save_change_checkpoint(feed: str, checked_at: datetime) -> None:
+    """
+    Record the time up to which a TMDB /changes feed has been processed.
+
+    :param feed: 'movie' or 'tv'
+    :param checked_at: UTC time
+    """
+    async with AsyncSession() as session:
+        await session.merge(ChangeCheckpoint(feed=feed, checked_at=checked_at))
+        await session.commit()
+
+
+@instrument_db
+async def remove_subscriber(user_id: int) -> None:
+    """
+    Remove a user from the subscribers list, e.g. after they blocked the bot.
+
+    :param user_id: Telegram user ID
+    """
+    async with AsyncSession() as session:
+        await session.execute(delete(Subscriber).filter_by(user_id=user_id))
+        await session.commit()
+
+
+@instrument_db
+async def get_or_create_broadcast(key: str, text: str, photo: Optional[str] = None) -> int:
+    """
+    Get the broadcast with the given key, creating it if it does not exist yet.
+
+    :param key: Unique broadcast key
+    :param text: Message text or photo caption
+    :param photo: Optional TMDB poster path to send with the message
+    :return: Broadcast ID
+    """
+    async with AsyncSession() as session:
+        await session.execute(_insert_ignore(Broadcast).values(key=key, text=text, photo=photo, status='running',
+                                                               created_at=datetime.utcnow()))
+        await session.commit()
+        return await session.scalar(select(Broadcast.id).filter_by(key=key))
+
+
+@instrument_db
+async def get_unfinished_broadcasts() -> List[Tuple[int, str, str, Optional[str]]]:
+    """
+    Get broadcasts that were interrupted before all subscribers were processed.
+
+    :return: List of (broadcast ID, key, text, photo) tuples
+    """
+    async with AsyncSession() as session:
+        result = await session.execute(
+            select(Broadcast.id, Broadcast.key, Broadcast.text, Broadcast.photo).filter_by(status='running')
+        )
+        return [tuple(row) for row in result]
+
+
+@instrument_db
+async def get_delivered_user_ids(broadcast_id: int, user_ids: Optional[Iterable[int]] = None) -> Set[int]:
+    """
+    Get the users a broadcast has already been processed for.
+
+    :param broadcast_id: Broadcast ID
+    :param user_ids: Only check these users, e.g. the current chunk of subscribers
+    :return: Set of user IDs
+    """
+    query = select(BroadcastDelivery.user_id).filter_by(broadcast_id=broadcast_id)
+    if user_ids is not None:
+        query = query.where(BroadcastDelivery.user_id.in_(list(user_ids)))
+    async with AsyncSession() as session:
+        result = await session.scalars(query)
+        return set(result)
+
+
+@instrument_db
+async def record_deliveries(broadcast_id: int, deliveries: Iterable[Tuple[int, str]]) -> None:
+    """
+    Persist the outcome of a batch of broadcast sends.
+
+    :param broadcast_id: Broadcast ID
+    :param deliveries: (user ID, status) pairs
+    """
+    now = datetime.utcnow()
+    rows = [{"broadcast_id": broadcast_id, "user_id": user_id, "status": status, "delivered_at": now}
+            for user_id, status in deliveries]
+    if not rows:
+        return
+    async with AsyncSession() as session:
+        await session.execute(_insert_ignore(BroadcastDelivery), rows)
+        await session.commit()
+
+
+@instrument_db
+async def finish_broadcast(broadcast_id: int) -> None:
+    """
+    Mark a broadcast as done.
+
+    :param broadcast_id: Broadcast ID
+    """
+    async with AsyncSession() as session:
+        await session.execute(update(Broadcast).filter_by(id=broadcast_id).values(
+            status='done', finished_at=datetime.utcnow()
+        ))
+        await session.commit()
+
+
+@instrument_db
+async def get_poster_file_id(poster_path: str) -> Optional[str]:
+    """
+    Get the Telegram file_id of a poster that has been sent before.
+
+    :param poster_path: TMDB size and poster path, e.g. 'w500/abc.jpg'
+    :return: Telegram file_id, or None if the poster has not been uploaded yet
+    """
+    async with AsyncSession() as session:
+        return await session.scalar(select(PosterFileId.file_id).filter_by(poster_path=poster_path))
+
+
+@instrument_db
+async def save_poster_file_id(poster_path: str, file_id: str) -> None:
+    """
+    Remember the Telegram file_id of an uploaded poster.
+
+    :param poster_path: TMDB size and poster path, e.g. 'w500/abc.jpg'
+    :param file_id: Telegram file_id
+    """
+    async with AsyncSession() as session:
+        await session.merge(PosterFileId(poster_path=poster_path, file_id=file_id))
+        await session.commit()
+
+
+@instrument_db
+async def delete_poster_file_id(poster_path: str) -> None:
+    """
+    Forget the file_id of a poster, e.g. after Telegram rejected it.
+
+    :param poster_path: TMDB size and poster path, e.g. 'w500/abc.jpg'
+    """
+    async with AsyncSession() as session:
+        await session.execute(delete(PosterFileId).filter_by(poster_path=poster_path))
+        await session.commit()
+
+
+@instrument_db
+async def get_trending_snapshot_row(time_window: str) -> Optional[TrendingSnapshotRow]:
+    """
+    Get the stored trending snapshot of a time window.
+
+    :param time_window: 'day' or 'week'
+    :return: The snapshot row, or None if it has never been refreshed
+    """
+    async with AsyncSession() as session:
+        return await session.get(TrendingSnapshotRow, time_window)
+
+
+@instrument_db
+async def save_trending_snapshot_row(time_window: str, message: str, poster_path: Optional[str], items: str,
+                                     refreshed_at: datetime) -> None:
+    """
+    Store (or replace) the trending snapshot of a time window.
+
+    :param time_window: 'day' or 'week'
+    :param message: Rendered Markdown message
+    :param poster_path: TMDB poster path to send with the message
+    :param items: JSON list of the trending items
+    :param refreshed_at: When the items were fetched
+    """
+    values = {'message': message, 'poster_path': poster_path, 'items': items, 'refreshed_at': refreshed_at}
+    dialect = postgresql if async_engine.dialect.name == 'postgresql' else sqlite
+    # 单条 upsert：冷启动时多个请求可能同时刷新同一时间窗口
+    statement = dialect.insert(TrendingSnapshotRow).values(time_window=time_window, **values) \
+        .on_conflict_do_update(index_elements=['time_window'], set_=values)
+    async with AsyncSession() as session:
+        await session.execute(statement)
+        await session.commit()
+
+
+async def close_database() -> None:
+    """Flush queued writes and dispose of the connection pools."""
+    await write_queue.close()
+    await async_engine.dispose()
+    engine.dispose()
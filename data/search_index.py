@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from config import SEARCH_INDEX_PATH, SEARCH_INDEX_MAX_ENTRIES, SEARCH_FUZZY_THRESHOLD
+from services.models import SearchHit
+
+logger = logging.getLogger(__name__)
+
+# 每次全文检索取出的候选条目数，之后再按相似度打分过滤
+CANDIDATE_LIMIT = 200
+# 前缀匹配和子串匹配的得分；模糊匹配的相似度也可能达到这些值，匹配类型单独返回
+PREFIX_SCORE = 1.0
+SUBSTRING_SCORE = 0.9
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS titles ("
+    "id INTEGER PRIMARY KEY, item_type TEXT NOT NULL, item_id INTEGER NOT NULL, title TEXT NOT NULL, "
+    "original_title TEXT, year TEXT, release_date TEXT, popularity REAL, vote_average REAL, poster_path TEXT, "
+    "last_seen REAL NOT NULL, UNIQUE (item_type, item_id))",
+    "CREATE INDEX IF NOT EXISTS ix_titles_last_seen ON titles (last_seen)",
+    # trigram 分词支持任意子串匹配，对中文标题同样有效
+    "CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts USING fts5("
+    "title, original_title, content='titles', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS titles_ai AFTER INSERT ON titles BEGIN "
+    "INSERT INTO titles_fts (rowid, title, original_title) VALUES (new.id, new.title, new.original_title); END",
+    "CREATE TRIGGER IF NOT EXISTS titles_ad AFTER DELETE ON titles BEGIN "
+    "INSERT INTO titles_fts (titles_fts, rowid, title, original_title) "
+    "VALUES ('delete', old.id, old.title, old.original_title); END",
+    "CREATE TRIGGER IF NOT EXISTS titles_au AFTER UPDATE OF title, original_title ON titles BEGIN "
+    "INSERT INTO titles_fts (titles_fts, rowid, title, original_title) "
+    "VALUES ('delete', old.id, old.title, old.original_title); "
+    "INSERT INTO titles_fts (rowid, title, original_title) VALUES (new.id, new.title, new.original_title); END",
+)
+
+_COLUMNS = ', '.join(f"titles.{column}" for column in (
+    'item_type', 'item_id', 'title', 'original_title', 'release_date', 'popularity', 'vote_average', 'poster_path'))
+
+# TMDB 中电影和电视剧字段名不同
+_FIELD_NAMES = {
+    'movie': ('title', 'original_title', 'release_date'),
+    'tv': ('name', 'original_name', 'first_air_date'),
+}
+
+
+def _item_type(item: Dict[str, Any]) -> Optional[str]:
+    """'movie' or 'tv' for a TMDB result, None for anything else (e.g. people in /search/multi)."""
+    media_type = item.get('media_type')
+    if media_type:
+        return media_type if media_type in _FIELD_NAMES else None
+    if 'title' in item:
+        return 'movie'
+    if 'name' in item:
+        return 'tv'
+    return None
+
+
+def _match_score(query: str, row_titles: Iterable[Optional[str]]) -> Tuple[float, bool]:
+    """
+    Similarity of a query to the best matching title.
+
+    :return: Tuple of (score, close): 1 for a prefix and 0.9 for a substring, both close;
+        otherwise the fuzzy similarity, which is never close however high it is
+    """
+    best = 0.0
+    substring = False
+    for title in filter(None, row_titles):
+        title = title.lower()
+        if title.startswith(query):
+            return PREFIX_SCORE, True
+        if query in title:
+            substring = True
+            continue
+        best = max(best, SequenceMatcher(None, query, title).ratio(),
+                   SequenceMatcher(None, query, title[:len(query)]).ratio())
+    if substring:
+        return SUBSTRING_SCORE, True
+    return best, False
+
+
+class IndexMatches(NamedTuple):
+    """Local search results, split into title matches and fuzzy (possibly misspelled) matches."""
+    movies: List[SearchHit]  # Titles starting with or containing the query
+    tv_shows: List[SearchHit]
+    fuzzy_movies: List[SearchHit]
+    fuzzy_tv_shows: List[SearchHit]
+
+    @property
+    def close_count(self) -> int:
+        return len(self.movies) + len(self.tv_shows)
+
+
+class SearchIndex:
+    """
+    Local full-text index of every movie and TV show the bot has seen from TMDB.
+
+    Titles are stored in a SQLite table with an FTS5 trigram index over the localized and
+    original titles, so lookups support prefix, substring and (via trigram overlap plus
+    a similarity check) fuzzy matching. Items are upserted incrementally; when the index
+    grows beyond max_entries the least recently seen items are dropped.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, fuzzy_threshold: float = 0.6):
+        self.path = path
+        self.max_entries = max_entries
+        self.fuzzy_threshold = fuzzy_threshold
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+        self._pending: Set[asyncio.Task] = set()
+
+    def _upsert(self, items: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        rows = []
+        for item in items:
+            item_type = _item_type(item)
+            if item_type is None or not item.get('id'):
+                continue
+            title_field, original_field, date_field = _FIELD_NAMES[item_type]
+            title = item.get(title_field) or item.get(original_field)
+            if not title:
+                continue
+            release_date = item.get(date_field) or None
+            rows.append((item_type, item['id'], title, item.get(original_field), release_date and release_date[:4],
+                         release_date, item.get('popularity'), item.get('vote_average'), item.get('poster_path'),
+                         now))
+        if not rows:
+            return
+        self._conn.executemany(
+            "INSERT INTO titles (item_type, item_id, title, original_title, year, release_date, popularity, "
+            "vote_average, poster_path, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (item_type, item_id) DO UPDATE SET title = excluded.title, "
+            "original_title = COALESCE(excluded.original_title, original_title), "
+            "year = COALESCE(excluded.year, year), release_date = COALESCE(excluded.release_date, release_date), "
+            "popularity = COALESCE(excluded.popularity, popularity), "
+            "vote_average = COALESCE(excluded.vote_average, vote_average), "
+            "poster_path = COALESCE(excluded.poster_path, poster_path), last_seen = excluded.last_seen",
+            rows
+        )
+        excess = self._conn.execute("SELECT COUNT(*) FROM titles").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute("DELETE FROM titles WHERE id IN (SELECT id FROM titles ORDER BY last_seen LIMIT ?)",
+                               (excess,))
+        self._conn.commit()
+
+    def _candidates(self, query: str) -> List[sqlite3.Row]:
+        if len(query) >= 3:
+            # 查询词的每个三元组都是一个候选条件，命中越多排名越靠前，
+            # 因此拼写有误也能找到
+            trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+            match = ' OR '.join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+            return self._conn.execute(
+                f"SELECT {_COLUMNS} FROM titles_fts JOIN titles ON titles.id = titles_fts.rowid "
+                "WHERE titles_fts MATCH ? ORDER BY rank LIMIT ?", (match, CANDIDATE_LIMIT)
+            ).fetchall()
+        # trigram 索引无法匹配少于三个字符的查询，直接扫描
+        pattern = f"%{query}%"
+        return self._conn.execute(
+            f"SELECT {_COLUMNS} FROM titles WHERE title LIKE ? OR original_title LIKE ? "
+            "ORDER BY popularity DESC LIMIT ?", (pattern, pattern, CANDIDATE_LIMIT)
+        ).fetchall()
+
+    def _search(self, query: str, limit: int) -> IndexMatches:
+        query = query.strip().lower()
+        if not query:
+            return IndexMatches([], [], [], [])
+        scored = []
+        for row in self._candidates(query):
+            score, close = _match_score(query, (row['title'], row['original_title']))
+            if close or score >= self.fuzzy_threshold:
+                scored.append((close, score, row['popularity'] or 0, row))
+        # 标题匹配总是排在模糊匹配之前
+        scored.sort(key=lambda entry: entry[:3], reverse=True)
+
+        results: Dict[Tuple[str, bool], List[SearchHit]] = {(item_type, close): [] for item_type in _FIELD_NAMES
+                                                            for close in (True, False)}
+        counts = dict.fromkeys(_FIELD_NAMES, 0)
+        for close, _, _, row in scored:
+            if counts[row['item_type']] < limit:
+                counts[row['item_type']] += 1
+                results[row['item_type'], close].append(
+                    SearchHit(row['item_type'], row['item_id'], row['title'], row['release_date'] or '', '',
+                              row['poster_path'], row['vote_average'] or 0, row['popularity'] or 0))
+        return IndexMatches(results['movie', True], results['tv', True], results['movie', False],
+                            results['tv', False])
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM titles").fetchone()[0]
+
+    async def upsert(self, items: Iterable[Dict[str, Any]]) -> None:
+        """
+        Add or update TMDB movie and TV results.
+
+        :param items: TMDB result dicts; people and incomplete items are ignored
+        """
+        items = list(items)
+        async with self._lock:
+            await asyncio.to_thread(self._upsert, items)
+
+    def upsert_soon(self, items: Iterable[Dict[str, Any]]) -> None:
+        """Upsert items in the background, without delaying the caller."""
+        task = asyncio.create_task(self.upsert(items))
+        self._pending.add(task)
+        task.add_done_callback(self._upsert_done)
+
+    def _upsert_done(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Failed to update search index: %s", task.exception())
+
+    async def search(self, query: str, limit: int = 20) -> IndexMatches:
+        """
+        Search the local index by title.
+
+        :param query: Search query
+        :param limit: Maximum results per type, title and fuzzy matches together
+        :return: Title and fuzzy matches, best first; the index does not keep overviews
+        """
+        async with self._lock:
+            return await asyncio.to_thread(self._search, query, limit)
+
+    async def count(self) -> int:
+        async with self._lock:
+            return await asyncio.to_thread(self._count)
+
+    async def close(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        self._conn.close()
+
+
+search_index: Optional[SearchIndex] = SearchIndex(SEARCH_INDEX_PATH, SEARCH_INDEX_MAX_ENTRIES,
+                                                  SEARCH_FUZZY_THRESHOLD) if SEARCH_INDEX_PATH else None
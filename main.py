@@ -1,12 +1,32 @@
+import asyncio
 import logging
 import datetime
+import secrets
+import signal
+from typing import Optional
 
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler
+from telegram.request import BaseRequest
 
+from bot.broadcast import resume_broadcasts
 from bot.handlers import start, help_command, search, view_watchlist, \
     remove_from_watchlist_handler, button, \
-    trending_command, send_weekly_trending
-from config import TELEGRAM_BOT_TOKEN
+    trending_command, send_weekly_trending, stats_command, error_handler
+from bot.inline import inline_query
+from bot.notifier import notify_watchlist_changes
+from bot.trending import refresh_trending_snapshots
+from bot.update_processor import PerChatUpdateProcessor, HandlerCallback, track_concurrency
+from bot.webhook import HTTPServer, add_webhook_route, add_metrics_route
+from config import TELEGRAM_BOT_TOKEN, BOT_MODE, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, \
+    WEBHOOK_SECRET_TOKEN, MAX_CONCURRENT_UPDATES, TRENDING_REFRESH_INTERVAL, WATCHLIST_NOTIFY_INTERVAL, \
+    METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT
+from data.database import close_database
+from data.search_index import search_index
+from services.metrics import instrument_handler
+from services.movie_service import response_cache
+from services.poster_service import close_poster_cache
+from services.tmdb_client import close_client
 
 # Enable logging
 logging.basicConfig(
@@ -14,25 +34,136 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    """Start the bot."""
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+# 供 Prometheus 抓取的 /metrics 端点，未开启时为 None
+metrics_server = HTTPServer(METRICS_LISTEN, METRICS_PORT) if METRICS_ENABLED and METRICS_PORT else None
+if metrics_server is not None:
+    add_metrics_route(metrics_server)
+
+
+async def post_init(application: Application) -> None:
+    """Start the metrics endpoint once the application is initialized."""
+    if metrics_server is not None:
+        await metrics_server.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Release shared resources once the bot has stopped."""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await response_cache.close()
+    await close_poster_cache()
+    await close_client()
+    if search_index is not None:
+        await search_index.close()
+    await close_database()
+
+
+def _registered(callback: HandlerCallback) -> HandlerCallback:
+    """
+    Wrap a callback registered with the application to record its concurrency and latency.
+
+    Only registered callbacks are wrapped, so the handlers button() dispatches to are not
+    counted a second time.
+    """
+    return track_concurrency(instrument_handler(callback))
+
+
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """
+    Create the application with all handlers and jobs registered.
+
+    :param request: Transport for Bot API calls instead of the default HTTP one, e.g. the
+        fake used by the benchmarks
+    """
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN) \
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES)) \
+        .post_init(post_init).post_shutdown(post_shutdown)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
 
     # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("search", search))
-    application.add_handler(CommandHandler("watchlist", view_watchlist))
-    application.add_handler(CommandHandler("remove", remove_from_watchlist_handler))
-    application.add_handler(CommandHandler('trending', trending_command))
-    application.add_handler(CallbackQueryHandler(button))
+    application.add_handler(CommandHandler("start", _registered(start)))
+    application.add_handler(CommandHandler("help", _registered(help_command)))
+    application.add_handler(CommandHandler("search", _registered(search)))
+    application.add_handler(CommandHandler("watchlist", _registered(view_watchlist)))
+    application.add_handler(CommandHandler("remove", _registered(remove_from_watchlist_handler)))
+    application.add_handler(CommandHandler('trending', _registered(trending_command)))
+    application.add_handler(CommandHandler('stats', _registered(stats_command)))
+    application.add_handler(CallbackQueryHandler(_registered(button)))
+    application.add_handler(InlineQueryHandler(_registered(inline_query)))
+    application.add_error_handler(error_handler)
     # Add job queue for scheduled tasks
     job_queue = application.job_queue
     # Schedule the weekly task to run every Sunday at 10:00 AM
     job_queue.run_daily(send_weekly_trending, days=(6,), time=datetime.time(10, 0, 0))
+    # Keep the /trending snapshots fresh in the background
+    job_queue.run_repeating(refresh_trending_snapshots, interval=TRENDING_REFRESH_INTERVAL, first=0)
+    # Tell users about releases and new episodes of the items on their watchlists
+    job_queue.run_repeating(notify_watchlist_changes, interval=WATCHLIST_NOTIFY_INTERVAL, first=60)
+    # Finish any broadcast interrupted by a previous crash or restart
+    job_queue.run_once(resume_broadcasts, when=0)
     # job_queue.run_repeating(send_weekly_trending, interval=10, first=0)
+    return application
+
+
+async def run_webhook(application: Application) -> None:
+    """
+    Serve updates posted by Telegram to the local HTTP listener until SIGINT/SIGTERM.
+
+    Every request must carry the webhook secret token. When the bot registers the webhook
+    itself (WEBHOOK_URL set) and WEBHOOK_SECRET_TOKEN is empty, a random token is generated
+    for this run; when the webhook is registered elsewhere a token must be configured.
+
+    On shutdown the listener stops accepting requests first, then queued updates are
+    processed and the application is shut down.
+
+    :raises RuntimeError: If WEBHOOK_URL and WEBHOOK_SECRET_TOKEN are both empty
+    """
+    secret_token = WEBHOOK_SECRET_TOKEN
+    if not secret_token:
+        if not WEBHOOK_URL:
+            # 没有密钥时任何人都能向监听端口伪造更新
+            raise RuntimeError("Webhook mode needs WEBHOOK_SECRET_TOKEN when WEBHOOK_URL is not set; "
+                               "use the same token when registering the webhook")
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET_TOKEN not set, using a random token for this run")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = HTTPServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    add_webhook_route(server, application, WEBHOOK_PATH, secret_token)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                              secret_token=secret_token,
+                                              allowed_updates=Update.ALL_TYPES)
+        logger.info("Webhook mode: listening on %s:%s%s", WEBHOOK_LISTEN, server.bound_port, WEBHOOK_PATH)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+
+def main() -> None:
+    """Start the bot."""
+    application = build_application()
     # Start the Bot
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
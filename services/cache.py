@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    """Counters describing cache effectiveness."""
+    hits: int = 0
+    stale_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: float  # After this the entry is stale and gets refreshed in the background
+    stale_until: float  # After this the entry is no longer served at all
+
+    def is_fresh(self, now: float) -> bool:
+        return now < self.expires_at
+
+    def is_usable(self, now: float) -> bool:
+        return now < self.stale_until
+
+
+class SQLiteCacheTier:
+    """Persistent second cache tier so entries survive restarts."""
+
+    def __init__(self, path: str, max_entries: int = 50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, stale_until REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_stale_until "
+                           "ON response_cache (stale_until)")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        row = self._conn.execute(
+            "SELECT value, expires_at, stale_until FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            value = pickle.loads(row[0])
+        except Exception:
+            # 旧版本代码保存的对象可能已无法还原，当作未命中，稍后会被覆盖
+            logger.warning("Discarding unreadable cache entry %s", key, exc_info=True)
+            return None
+        return CacheEntry(value, row[1], row[2])
+
+    def _set(self, key: str, entry: CacheEntry) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at, stale_until) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(entry.value, protocol=pickle.HIGHEST_PROTOCOL), entry.expires_at,
+             entry.stale_until)
+        )
+        self._conn.commit()
+
+    def _prune(self) -> None:
+        self._conn.execute("DELETE FROM response_cache WHERE stale_until < ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            "SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self._conn.commit()
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, entry: CacheEntry) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, entry)
+
+    async def prune(self) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._prune)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache with per-entry TTL and stale-while-revalidate.
+
+    Fresh entries are returned directly. Stale entries (past their TTL but within the stale
+    window) are returned immediately while a background task refreshes them. Misses fall
+    through to the optional SQLite tier and finally to the loader.
+    """
+
+    def __init__(self, max_entries: int = 2048, stale_ttl: float = 86400,
+                 disk_tier: Optional[SQLiteCacheTier] = None, prune_interval: int = 500):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.disk_tier = disk_tier
+        self.prune_interval = prune_interval
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._disk_writes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _make_entry(self, value: Any, ttl: float) -> CacheEntry:
+        now = time.time()
+        return CacheEntry(value, now + ttl, now + ttl + self.stale_ttl)
+
+    async def _store(self, key: str, value: Any, ttl: float) -> None:
+        entry = self._make_entry(value, ttl)
+        self._remember(key, entry)
+        if self.disk_tier is not None:
+            try:
+                await self.disk_tier.set(key, entry)
+                self._disk_writes += 1
+                if self._disk_writes % self.prune_interval == 0:
+                    await self.disk_tier.prune()
+            except sqlite3.Error:
+                logger.exception("Failed to write cache entry %s to disk", key)
+
+    async def _lookup(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if self.disk_tier is not None:
+            try:
+                entry = await self.disk_tier.get(key)
+            except sqlite3.Error:
+                logger.exception("Failed to read cache entry %s from disk", key)
+                return None
+            if entry is not None and entry.is_usable(time.time()):
+                self.stats.disk_hits += 1
+                self._remember(key, entry)
+                return entry
+        return None
+
+    def _schedule_refresh(self, key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh() -> None:
+            try:
+                await self._store(key, await loader(), ttl)
+                self.stats.refreshes += 1
+            except Exception:
+                self.stats.refresh_errors += 1
+                logger.warning("Background refresh of %s failed", key, exc_info=True)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Return a usable in-memory value without touching LRU order, counters or the loader."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.is_usable(time.time()):
+            return entry.value
+        return None
+
+    async def last_known(self, key: str) -> Optional[CacheEntry]:
+        """
+        The most recent entry for key however old, for when upstream is unavailable.
+
+        Entries past their stale window stay in memory until evicted and on disk until pruned.
+
+        :param key: Cache key
+        :return: The entry, or None if the key has never been cached or was evicted
+        """
+        entry = self._entries.get(key)
+        if entry is not None or self.disk_tier is None:
+            return entry
+        try:
+            return await self.disk_tier.get(key)
+        except sqlite3.Error:
+            logger.exception("Failed to read cache entry %s from disk", key)
+            return None
+
+    async def get_or_fetch(self, key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, loading it if necessary.
+
+        :param key: Cache key
+        :param ttl: Seconds the value stays fresh
+        :param loader: Coroutine factory that fetches the value from upstream
+        :return: Cached or freshly loaded value
+        """
+        entry = await self._lookup(key)
+        now = time.time()
+        if entry is not None and entry.is_fresh(now):
+            self.stats.hits += 1
+            return entry.value
+        if entry is not None and entry.is_usable(now):
+            self.stats.stale_hits += 1
+            self._schedule_refresh(key, ttl, loader)
+            return entry.value
+
+        self.stats.misses += 1
+        value = await loader()
+        await self._store(key, value, ttl)
+        return value
+
+    async def reload(self, key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Load a value from upstream even if a fresh copy is cached, and cache it.
+
+        :param key: Cache key
+        :param ttl: Seconds the value stays fresh
+        :param loader: Coroutine factory that fetches the value from upstream
+        :return: Freshly loaded value
+        """
+        value = await loader()
+        await self._store(key, value, ttl)
+        self.stats.refreshes += 1
+        return value
+
+    async def close(self) -> None:
+        """Cancel pending refreshes and close the disk tier."""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+        if self.disk_tier is not None:
+            self.disk_tier.close()
+
+
+def make_key(endpoint: str, path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Build a stable cache key from an endpoint name, path and query parameters."""
+    items: Tuple[Tuple[str, Any], ...] = tuple(sorted((params or {}).items()))
+    return f"{endpoint}:{path}?" + "&".join(f"{k}={v}" for k, v in items)
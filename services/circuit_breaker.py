@@ -0,0 +1,120 @@
+import logging
+import time
+from enum import Enum
+from typing import Dict
+
+import httpx
+
+from config import METRICS_ENABLED
+from services.metrics import TMDB_BREAKER_STATE, TMDB_BREAKER_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+
+class BreakerState(Enum):
+    CLOSED = 'closed'  # Requests pass; consecutive failures are counted
+    OPEN = 'open'  # Requests fail fast until reset_timeout has passed
+    HALF_OPEN = 'half_open'  # A few probe requests decide whether to close again
+
+
+# /metrics 中的状态值
+_STATE_VALUES = {BreakerState.CLOSED: 0, BreakerState.HALF_OPEN: 1, BreakerState.OPEN: 2}
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of sending a request while the endpoint's circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker for one upstream endpoint.
+
+    failure_threshold consecutive failures open the circuit. After reset_timeout seconds
+    up to half_open_max_calls probe requests are let through: a successful probe closes
+    the circuit, a failed one opens it again. Transitions are logged and counted.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    def allows_request(self) -> bool:
+        """Whether acquire() would let a request through right now, without changing state."""
+        if self.state is BreakerState.CLOSED:
+            return True
+        if self.state is BreakerState.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return self._probes < self.half_open_max_calls
+
+    def acquire(self) -> bool:
+        """
+        Let a request through or fail fast.
+
+        :return: True if the request is a half-open probe; pass it on to record_success,
+            record_failure or release
+        :raises CircuitOpenError: If the circuit is open or all probe slots are taken
+        """
+        if self.state is BreakerState.OPEN:
+            retry_in = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+            self._transition(BreakerState.HALF_OPEN)
+        if self.state is BreakerState.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                raise CircuitOpenError(self.name, 0)
+            self._probes += 1
+            return True
+        return False
+
+    def record_success(self, probe: bool) -> None:
+        if probe:
+            self._probes -= 1
+            if self.state is BreakerState.HALF_OPEN:
+                self._transition(BreakerState.CLOSED)
+        elif self.state is BreakerState.CLOSED:
+            self.failures = 0
+
+    def record_failure(self, probe: bool) -> None:
+        if probe:
+            self._probes -= 1
+            if self.state is BreakerState.HALF_OPEN:
+                self._transition(BreakerState.OPEN)
+        elif self.state is BreakerState.CLOSED:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self._transition(BreakerState.OPEN)
+
+    def release(self, probe: bool) -> None:
+        """Give back a probe slot of a request that ended without a verdict, e.g. cancelled."""
+        if probe:
+            self._probes -= 1
+
+    def _transition(self, state: BreakerState) -> None:
+        if state is BreakerState.OPEN and self.state is BreakerState.CLOSED:
+            logger.warning("TMDB circuit %s: %s -> %s after %s consecutive failures",
+                           self.name, self.state.value, state.value, self.failures)
+        else:
+            logger.warning("TMDB circuit %s: %s -> %s", self.name, self.state.value, state.value)
+        self.state = state
+        if state is BreakerState.OPEN:
+            self.opened_at = time.monotonic()
+        elif state is BreakerState.CLOSED:
+            self.failures = 0
+        if METRICS_ENABLED:
+            TMDB_BREAKER_TRANSITIONS.inc(self.name, state.value)
+            TMDB_BREAKER_STATE.set(_STATE_VALUES[state], self.name)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {'state': self.state.value, 'failures': self.failures}
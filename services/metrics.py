@@ -0,0 +1,207 @@
+import bisect
+import functools
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from config import METRICS_ENABLED
+
+AsyncFunction = TypeVar('AsyncFunction', bound=Callable[..., Awaitable[Any]])
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label combination."""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                                for labels, value in sorted(self.values.items())]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, per label combination."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                                for labels, value in sorted(self.values.items())]
+
+
+class _HistogramSeries:
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self, bucket_count: int):
+        self.counts = [0] * (bucket_count + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+
+
+class Histogram(_Metric):
+    """
+    Bucketed distribution per label combination.
+
+    Memory is constant per series; quantiles are estimated by linear interpolation
+    within the bucket that contains them, like Prometheus' histogram_quantile.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self.series: Dict[Labels, _HistogramSeries] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = _HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.total += value
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimate the q-quantile (0-1) of a series, or None if it has no observations."""
+        series = self.series.get(labels)
+        if series is None or not series.count:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for index, count in enumerate(series.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # Beyond the largest bucket
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series.total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series.count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+# 渲染时才读取的外部统计（缓存、限速器等），返回 (名称, 值) 列表
+COLLECTORS: List[Callable[[], List[Tuple[str, float]]]] = []
+
+HANDLER_LATENCY = Histogram('bot_handler_duration_seconds', 'Time spent in bot handlers.', ('handler',))
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Bot handler calls that raised.', ('handler',))
+TMDB_LATENCY = Histogram('tmdb_request_duration_seconds', 'TMDB request latency, including retries.',
+                         ('endpoint',))
+TMDB_RESPONSES = Counter('tmdb_responses_total', 'TMDB responses by status code.', ('endpoint', 'status'))
+TMDB_RETRIES = Counter('tmdb_retries_total', 'TMDB requests retried after a 429.', ('endpoint',))
+TMDB_BREAKER_TRANSITIONS = Counter('tmdb_breaker_transitions_total', 'TMDB circuit breaker state changes.',
+                                   ('endpoint', 'state'))
+TMDB_BREAKER_STATE = Gauge('tmdb_breaker_state', 'TMDB circuit state: 0 closed, 1 half-open, 2 open.', ('endpoint',))
+DB_LATENCY = Histogram('db_call_duration_seconds', 'Time spent in database functions.', ('function',))
+DB_ERRORS = Counter('db_call_errors_total', 'Database function calls that raised.', ('function',))
+BROADCAST_MESSAGES = Counter('broadcast_messages_total', 'Broadcast messages by outcome.', ('status',))
+BROADCAST_SEND_LATENCY = Histogram('broadcast_send_duration_seconds', 'Time to deliver one broadcast message.')
+BROADCAST_THROUGHPUT = Gauge('broadcast_throughput_messages_per_second', 'Throughput of the last broadcast.')
+
+
+def endpoint_label(path: str) -> str:
+    """Collapse IDs in an API path so all calls of an endpoint share one series, e.g. '/movie/{id}'."""
+    return re.sub(r'/\d+', '/{id}', path)
+
+
+def _instrument(histogram: Histogram, errors: Counter) -> Callable[[AsyncFunction], AsyncFunction]:
+    def decorator(fn: AsyncFunction) -> AsyncFunction:
+        if not METRICS_ENABLED:
+            return fn  # 关闭时不包装，没有任何额外开销
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+# 处理函数和数据库函数的装饰器，按函数名记录延迟和异常
+instrument_handler = _instrument(HANDLER_LATENCY, HANDLER_ERRORS)
+instrument_db = _instrument(DB_LATENCY, DB_ERRORS)
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for collector in COLLECTORS:
+        for name, value in collector():
+            lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def latency_summary(histogram: Histogram, limit: int = 10) -> List[str]:
+    """
+    Human-readable p50/p95/p99 of the busiest series of a latency histogram.
+
+    :param histogram: Histogram in seconds
+    :param limit: Maximum number of series, busiest first
+    :return: One line per series
+    """
+    lines = []
+    busiest = sorted(histogram.series.items(), key=lambda entry: entry[1].count, reverse=True)[:limit]
+    for labels, series in busiest:
+        p50, p95, p99 = (histogram.quantile(q, *labels) * 1000 for q in (0.5, 0.95, 0.99))
+        lines.append(f"{'/'.join(labels) or histogram.name}: n={series.count} "
+                     f"p50={p50:.0f}ms p95={p95:.0f}ms p99={p99:.0f}ms")
+    return lines
@@ -0,0 +1,206 @@
+"""
+Compact, immutable records of the TMDB data the bot uses.
+
+TMDB responses are decoded straight into these records and everything else (credits,
+reviews, genres, production details...) is dropped, so caches and snapshots only hold
+the handful of fields the handlers read. The records answer `record['title']` and
+`record.get('poster_path')` like the raw JSON did, including the different field names
+TMDB uses for movies and TV shows.
+
+Records served from the cache while TMDB is unavailable have stale set, so handlers can
+say the data may be out of date.
+"""
+import json
+from dataclasses import dataclass, field, replace
+from typing import Any, ClassVar, Dict, Optional, Tuple, TypeVar
+
+from config import TMDB_IMAGE_BASE_URL
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def loads(data: bytes) -> Any:
+    """Decode a JSON response body, with orjson when it is installed."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def get_poster_url(poster_path: Optional[str], size: str = 'w500') -> Optional[str]:
+    """
+    Build the full image URL of a TMDB poster.
+
+    :param poster_path: TMDB poster path, e.g. '/abc.jpg'
+    :param size: TMDB image size, e.g. 'w342' or 'w500'
+    :return: Poster URL, or None if there is no poster
+    """
+    return f"{TMDB_IMAGE_BASE_URL}/{size}{poster_path}" if poster_path else None
+
+
+class _Record:
+    """Read-only mapping access to a record's fields under their TMDB names."""
+    __slots__ = ()
+    # TMDB name -> attribute, for names that differ from the attribute
+    _aliases: ClassVar[Dict[str, str]] = {}
+
+    def keys(self) -> Tuple[str, ...]:
+        raise NotImplementedError
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, self._aliases.get(key, key))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self.keys() else default
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.keys()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The record as TMDB-style JSON, readable by the matching from_json."""
+        return {key: value.to_dict() if isinstance(value, _Record) else value
+                for key, value in ((key, self[key]) for key in self.keys()) if key != 'poster_url'}
+
+
+@dataclass(frozen=True, slots=True)
+class SearchHit(_Record):
+    """A movie or TV show in search or trending results."""
+    item_type: str  # 'movie' or 'tv'
+    id: int
+    title: str
+    date: str  # release_date of movies, first_air_date of TV shows
+    overview: str
+    poster_path: Optional[str]
+    vote_average: float
+    popularity: float
+    stale: bool = field(default=False, compare=False)
+
+    _aliases: ClassVar[Dict[str, str]] = {'name': 'title', 'release_date': 'date', 'first_air_date': 'date',
+                                          'media_type': 'item_type'}
+    _MOVIE_KEYS: ClassVar[Tuple[str, ...]] = ('id', 'title', 'release_date', 'overview', 'poster_path',
+                                              'poster_url', 'vote_average', 'popularity', 'item_type', 'media_type')
+    _TV_KEYS: ClassVar[Tuple[str, ...]] = ('id', 'name', 'first_air_date', 'overview', 'poster_path',
+                                           'poster_url', 'vote_average', 'popularity', 'item_type', 'media_type')
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._MOVIE_KEYS if self.item_type == 'movie' else self._TV_KEYS
+
+    @property
+    def poster_url(self) -> Optional[str]:
+        return get_poster_url(self.poster_path)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any], item_type: Optional[str] = None) -> 'SearchHit':
+        """
+        Keep the displayed fields of a TMDB result.
+
+        :param data: Result from a search, trending or discover response
+        :param item_type: 'movie' or 'tv'; taken from media_type or the title field if omitted
+        """
+        item_type = item_type or data.get('item_type') or data.get('media_type') or \
+            ('movie' if 'title' in data else 'tv')
+        is_movie = item_type == 'movie'
+        return cls(item_type, data['id'], data.get('title' if is_movie else 'name') or '',
+                   data.get('release_date' if is_movie else 'first_air_date') or '', data.get('overview') or '',
+                   data.get('poster_path'), data.get('vote_average') or 0, data.get('popularity') or 0)
+
+
+@dataclass(frozen=True, slots=True)
+class Movie(_Record):
+    """Details of a movie."""
+    id: int
+    title: str
+    release_date: str
+    overview: str
+    poster_path: Optional[str]
+    vote_average: float
+    status: Optional[str]
+    stale: bool = field(default=False, compare=False)
+
+    item_type: ClassVar[str] = 'movie'
+    _KEYS: ClassVar[Tuple[str, ...]] = ('id', 'title', 'release_date', 'overview', 'poster_path', 'poster_url',
+                                        'vote_average', 'status', 'item_type')
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._KEYS
+
+    @property
+    def poster_url(self) -> Optional[str]:
+        return get_poster_url(self.poster_path)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> 'Movie':
+        return cls(data['id'], data.get('title') or '', data.get('release_date') or '', data.get('overview') or '',
+                   data.get('poster_path'), data.get('vote_average') or 0, data.get('status'))
+
+
+@dataclass(frozen=True, slots=True)
+class Episode(_Record):
+    """An episode of a TV show, as in last_episode_to_air."""
+    season_number: Optional[int]
+    episode_number: Optional[int]
+    air_date: Optional[str]
+
+    _KEYS: ClassVar[Tuple[str, ...]] = ('season_number', 'episode_number', 'air_date')
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._KEYS
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict[str, Any]]) -> Optional['Episode']:
+        if not data:
+            return None
+        return cls(data.get('season_number'), data.get('episode_number'), data.get('air_date'))
+
+
+@dataclass(frozen=True, slots=True)
+class TVShow(_Record):
+    """Details of a TV show."""
+    id: int
+    name: str
+    first_air_date: str
+    overview: str
+    poster_path: Optional[str]
+    vote_average: float
+    status: Optional[str]
+    last_episode_to_air: Optional[Episode]
+    stale: bool = field(default=False, compare=False)
+
+    item_type: ClassVar[str] = 'tv'
+    _KEYS: ClassVar[Tuple[str, ...]] = ('id', 'name', 'first_air_date', 'overview', 'poster_path', 'poster_url',
+                                        'vote_average', 'status', 'last_episode_to_air', 'item_type')
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._KEYS
+
+    @property
+    def poster_url(self) -> Optional[str]:
+        return get_poster_url(self.poster_path)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> 'TVShow':
+        return cls(data['id'], data.get('name') or '', data.get('first_air_date') or '', data.get('overview') or '',
+                   data.get('poster_path'), data.get('vote_average') or 0, data.get('status'),
+                   Episode.from_json(data.get('last_episode_to_air')))
+
+
+Value = TypeVar('Value')
+
+
+def as_stale(value: Value) -> Value:
+    """
+    Copy of a cached record, list of records or tuple of lists with every record marked stale.
+
+    :param value: Value as returned by the movie_service functions
+    :return: The same structure with stale=True records
+    """
+    if isinstance(value, (SearchHit, Movie, TVShow)):
+        return replace(value, stale=True)
+    if isinstance(value, list):
+        return [as_stale(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(as_stale(item) for item in value)
+    return value
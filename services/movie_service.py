@@ -1,157 +1,338 @@
-from typing import List, Dict, Any
+import asyncio
+import logging
+import time
+from datetime import date
+from typing import List, Dict, Any, Callable, Optional, Set, Tuple, Union
 
-import requests
+import httpx
 
-from config import TMDB_API_KEY
+from config import CACHE_MAX_ENTRIES, CACHE_STALE_TTL, CACHE_TTL_DETAILS, CACHE_TTL_SEARCH, CACHE_TTL_TRENDING, \
+    CACHE_DB_PATH, TMDB_USE_SEARCH_MULTI, SEARCH_LOCAL_MIN_RESULTS
+from data.search_index import search_index
+from services.cache import ResponseCache, SQLiteCacheTier, make_key
+from services.metrics import COLLECTORS
+from services.models import Movie, SearchHit, TVShow, as_stale
+from services.rate_limiter import Priority, use_priority
+from services.singleflight import SingleFlight
+from services.tmdb_client import get_client
 
-BASE_URL = "https://api.themoviedb.org/3"
-IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
-HEADERS = {
-    "Authorization": f"Bearer {TMDB_API_KEY}",
-    "accept": "application/json"
+logger = logging.getLogger(__name__)
+
+# 每类接口的缓存时间（秒）
+CACHE_TTLS = {
+    "details": CACHE_TTL_DETAILS,
+    "search": CACHE_TTL_SEARCH,
+    "trending": CACHE_TTL_TRENDING,
 }
 
+response_cache = ResponseCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    stale_ttl=CACHE_STALE_TTL,
+    disk_tier=SQLiteCacheTier(CACHE_DB_PATH) if CACHE_DB_PATH else None,
+)
+
+MOVIE_DETAILS_PARAMS = {"language": "zh-CN"}
+TV_DETAILS_PARAMS = {"language": "zh-CN"}
+
+# 合并相同请求的并发调用，热门条目被大量点击时只请求一次 TMDB
+inflight_requests = SingleFlight()
+
+
+def _movie_hits(data: Dict[str, Any]) -> List[SearchHit]:
+    return [SearchHit.from_json(item, 'movie') for item in data.get("results", [])]
+
+
+def _tv_hits(data: Dict[str, Any]) -> List[SearchHit]:
+    return [SearchHit.from_json(item, 'tv') for item in data.get("results", [])]
+
+
+# 缓存的是精简后的模型；模型字段变化时递增，避免读到磁盘缓存中旧版本保存的数据
+CACHE_KEY_PREFIX = "m3:"
+
+
+def _cache_key(endpoint: str, path: str, params: Dict[str, Any]) -> str:
+    return CACHE_KEY_PREFIX + make_key(endpoint, path, params)
+
+
+async def _cached_get(endpoint: str, path: str, params: Dict[str, Any],
+                      transform: Callable[[Dict[str, Any]], Any], refresh: bool = False) -> Any:
+    """
+    Fetch a TMDB path through the response cache.
+
+    Concurrent callers asking for the same path and parameters are coalesced, so a
+    cache miss results in a single upstream request and a single cache write.
+
+    While the endpoint's circuit is open, or when the request fails, the last value
+    cached for the path is returned however old it is, with its records marked stale.
+
+    :param endpoint: Endpoint category used to pick the TTL ('details', 'search' or 'trending')
+    :param path: API path
+    :param params: Query parameters
+    :param transform: Converts the decoded JSON response into the compact model that gets cached
+    :param refresh: Skip the cached copy and fetch (and cache) a fresh one
+    :return: Cached or freshly fetched value
+    :raises httpx.HTTPError: If TMDB is unavailable and nothing was ever cached for the path
+    """
+    key = _cache_key(endpoint, path, params)
+
+    async def load() -> Any:
+        data = await get_client().get(path, params=params)
+        if search_index is not None:
+            # 记录见过的所有电影和电视剧，供本地搜索使用
+            search_index.upsert_soon(data['results'] if 'results' in data else [data])
+        return transform(data)
 
-def get_trending_movies(time_window: str = "day") -> List[Dict[str, Any]]:
+    if refresh:
+        # 调用方明确需要最新数据，不退回旧副本
+        return await inflight_requests.do(f"{key}#reload",
+                                          lambda: response_cache.reload(key, CACHE_TTLS[endpoint], load))
+    if not get_client().allows_request(path):
+        # 熔断期间不等待 TMDB，直接使用最后一次成功获取的数据
+        entry = await response_cache.last_known(key)
+        if entry is not None:
+            return entry.value if entry.is_fresh(time.time()) else as_stale(entry.value)
+    try:
+        return await inflight_requests.do(key, lambda: response_cache.get_or_fetch(key, CACHE_TTLS[endpoint], load))
+    except httpx.HTTPError as e:
+        entry = await response_cache.last_known(key)
+        if entry is None:
+            raise
+        logger.warning("TMDB request for %s failed (%s), serving the last cached copy", path, e)
+        return as_stale(entry.value)
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """Return hit/miss/eviction counters of the response cache."""
+    stats = response_cache.stats.as_dict()
+    stats["entries"] = len(response_cache)
+    return stats
+
+
+def get_rate_limiter_stats() -> Dict[str, object]:
+    """Return the TMDB rate limiter's current rate, queue depth and wait-time metrics."""
+    return get_client().rate_limiter.snapshot()
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, object]]:
+    """Return the state and failure count of each TMDB endpoint's circuit breaker."""
+    return {endpoint: breaker.snapshot() for endpoint, breaker in get_client().breakers.items()}
+
+
+def get_inflight_stats() -> Dict[str, int]:
+    """Return counters of the request coalescer."""
+    stats = inflight_requests.stats.as_dict()
+    stats["in_flight"] = inflight_requests.in_flight()
+    return stats
+
+
+def _collect_stats() -> List[Tuple[str, float]]:
+    """Cache, coalescer and rate limiter counters for the /metrics endpoint."""
+    samples = [(f"response_cache_{name}", value) for name, value in get_cache_stats().items()]
+    samples += [(f"singleflight_{name}", value) for name, value in get_inflight_stats().items()]
+    limiter = get_rate_limiter_stats()
+    samples += [("tmdb_rate_limit_rate", limiter["rate"]), ("tmdb_rate_limit_throttled", limiter["throttled"])]
+    samples += [(f'tmdb_rate_limit_queue_depth{{lane="{lane}"}}', depth)
+                for lane, depth in limiter["queue_depth"].items()]
+    for lane, lane_stats in limiter["lanes"].items():
+        samples += [(f'tmdb_rate_limit_acquired_total{{lane="{lane}"}}', lane_stats["acquired"]),
+                    (f'tmdb_rate_limit_wait_seconds_avg{{lane="{lane}"}}', lane_stats["avg_wait"]),
+                    (f'tmdb_rate_limit_wait_seconds_max{{lane="{lane}"}}', lane_stats["max_wait"])]
+    return samples
+
+
+COLLECTORS.append(_collect_stats)
+
+
+async def get_trending_movies(time_window: str = "day", refresh: bool = False) -> List[SearchHit]:
     """
     Get trending movies for the day or week.
 
     :param time_window: 'day' or 'week'
+    :param refresh: Bypass the cache, e.g. when rebuilding the trending snapshot
     :return: List of trending movies
     """
-    url = f"{BASE_URL}/trending/movie/{time_window}"
-    params = {"language": "zh-CN"}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    data = response.json()
-    results = data.get("results", [])
-    for movie in results:
-        if movie['poster_path']:
-            movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-        else:
-            movie['poster_url'] = None
-    return data.get("results", [])
+    return await _cached_get("trending", f"/trending/movie/{time_window}", {"language": "zh-CN"},
+                             _movie_hits, refresh)
 
 
-def search_movies(query: str) -> List[Dict[str, Any]]:
+async def search_movies(query: str) -> List[SearchHit]:
     """
     Search for movies based on a query string.
 
     :param query: Search query
     :return: List of movie search results
     """
-    url = f"{BASE_URL}/search/movie"
     params = {"query": query, "language": "zh-CN", "page": 1}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    data = response.json()
-    results = data.get("results", [])
-    for movie in results:
-        if movie['poster_path']:
-            movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-        else:
-            movie['poster_url'] = None
-    return results
+    return await _cached_get("search", "/search/movie", params, _movie_hits)
 
 
-def get_movie_details(movie_id: int) -> Dict[str, Any]:
+async def get_movie_details(movie_id: int, refresh: bool = False) -> Movie:
     """
     Get detailed information about a specific movie.
 
     :param movie_id: TMDB movie ID
-    :return: Dictionary containing movie details
+    :param refresh: Bypass the cache, e.g. after TMDB reported the movie as changed
+    :return: Movie details
     """
-    url = f"{BASE_URL}/movie/{movie_id}"
-    params = {"language": "zh-CN", "append_to_response": "credits,reviews"}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    movie = response.json()
-    if movie['poster_path']:
-        movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-    else:
-        movie['poster_url'] = None
-    return movie
+    return await _cached_get("details", f"/movie/{movie_id}", MOVIE_DETAILS_PARAMS, Movie.from_json, refresh)
 
 
-def get_trending_tv_shows(time_window: str = "day") -> List[Dict[str, Any]]:
+async def get_trending_tv_shows(time_window: str = "day", refresh: bool = False) -> List[SearchHit]:
     """
     Get trending TV shows for the day or week.
 
     :param time_window: 'day' or 'week'
+    :param refresh: Bypass the cache, e.g. when rebuilding the trending snapshot
     :return: List of trending TV shows
     """
-    url = f"{BASE_URL}/trending/tv/{time_window}"
-    params = {"language": "zh-CN"}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    data = response.json()
-    results = data.get("results", [])
-    for movie in results:
-        if movie['poster_path']:
-            movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-        else:
-            movie['poster_url'] = None
-    return data.get("results", [])
+    return await _cached_get("trending", f"/trending/tv/{time_window}", {"language": "zh-CN"},
+                             _tv_hits, refresh)
 
 
-def search_tv_shows(query: str) -> List[Dict[str, Any]]:
+async def search_tv_shows(query: str) -> List[SearchHit]:
     """
     Search for TV shows based on a query string.
 
     :param query: Search query
     :return: List of TV show search results
     """
-    url = f"{BASE_URL}/search/tv"
     params = {"query": query, "language": "zh-CN", "page": 1}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    data = response.json()
+    return await _cached_get("search", "/search/tv", params, _tv_hits)
+
+
+def _split_multi_results(data: Dict[str, Any]) -> Tuple[List[SearchHit], List[SearchHit]]:
     results = data.get("results", [])
-    for movie in results:
-        if movie['poster_path']:
-            movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-        else:
-            movie['poster_url'] = None
-    return data.get("results", [])
+    movies = [SearchHit.from_json(item, 'movie') for item in results if item.get('media_type') == 'movie']
+    tv_shows = [SearchHit.from_json(item, 'tv') for item in results if item.get('media_type') == 'tv']
+    return movies, tv_shows
 
 
-def get_tv_show_details(tv_id: int) -> Dict[str, Any]:
+async def search_multi(query: str) -> Tuple[List[SearchHit], List[SearchHit]]:
+    """
+    Search movies and TV shows with TMDB's /search/multi endpoint in a single request.
+
+    :param query: Search query
+    :return: Tuple of (movie results, TV show results); person results are dropped
+    """
+    params = {"query": query, "language": "zh-CN", "page": 1}
+    return await _cached_get("search", "/search/multi", params, _split_multi_results)
+
+
+async def search_all(query: str) -> Tuple[List[SearchHit], List[SearchHit]]:
+    """
+    Search movies and TV shows concurrently.
+
+    Uses /search/multi when TMDB_USE_SEARCH_MULTI is enabled, otherwise runs the movie
+    and TV searches in parallel.
+
+    :param query: Search query
+    :return: Tuple of (movie results, TV show results)
+    """
+    if TMDB_USE_SEARCH_MULTI:
+        return await search_multi(query)
+    movies, tv_shows = await asyncio.gather(search_movies(query), search_tv_shows(query))
+    return movies, tv_shows
+
+
+def _merge_results(local: List[SearchHit], remote: List[SearchHit]) -> List[SearchHit]:
+    """Combine local and TMDB results, preferring TMDB's copy of an item found in both."""
+    remote_ids = {item.id for item in remote}
+    return remote + [item for item in local if item.id not in remote_ids]
+
+
+async def search_titles(query: str) -> Tuple[List[SearchHit], List[SearchHit]]:
+    """
+    Search movies and TV shows, answering from the local title index when it can.
+
+    TMDB is only asked when the index has fewer than SEARCH_LOCAL_MIN_RESULTS titles
+    starting with or containing the query; its results are then merged with the local
+    ones. Fuzzy matches never count toward the threshold and are only shown next to
+    TMDB's results, so similar titles in the index cannot hide the one searched for.
+
+    :param query: Search query
+    :return: Tuple of (movie results, TV show results)
+    """
+    if search_index is None:
+        return await search_all(query)
+    matches = await search_index.search(query)
+    if matches.close_count >= SEARCH_LOCAL_MIN_RESULTS:
+        return matches.movies, matches.tv_shows
+    remote_movies, remote_tv_shows = await search_all(query)
+    return _merge_results(matches.movies + matches.fuzzy_movies, remote_movies), \
+        _merge_results(matches.tv_shows + matches.fuzzy_tv_shows, remote_tv_shows)
+
+
+async def get_tv_show_details(tv_id: int, refresh: bool = False) -> TVShow:
     """
     Get detailed information about a specific TV show.
 
     :param tv_id: TMDB TV show ID
-    :return: Dictionary containing TV show details
+    :param refresh: Bypass the cache, e.g. after TMDB reported the show as changed
+    :return: TV show details
     """
-    url = f"{BASE_URL}/tv/{tv_id}"
-    params = {"language": "zh-CN"}
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    movie = response.json()
-    if movie['poster_path']:
-        movie['poster_url'] = f"{IMAGE_BASE_URL}{movie['poster_path']}"
-    else:
-        movie['poster_url'] = None
-    return movie
+    return await _cached_get("details", f"/tv/{tv_id}", TV_DETAILS_PARAMS, TVShow.from_json, refresh)
 
 
-def get_trending_items(time_window: str = "day") -> List[Dict[str, Any]]:
+async def get_trending_items(time_window: str = "day", refresh: bool = False) -> List[SearchHit]:
     """
     Get trending movies and TV shows for the day or week.
 
     :param time_window: 'day' or 'week'
+    :param refresh: Bypass the cache, e.g. when rebuilding the trending snapshot
     :return: List of trending movies and TV shows
     """
-    movies = get_trending_movies(time_window)
-    tv_shows = get_trending_tv_shows(time_window)
+    movies, tv_shows = await asyncio.gather(get_trending_movies(time_window, refresh),
+                                            get_trending_tv_shows(time_window, refresh))
+
+    # 组合 movies 和 tv_shows，每项的 item_type 区分电影和电视剧
+    return movies + tv_shows
+
+
+async def get_changed_ids(item_type: str, start_date: date, end_date: date) -> Set[int]:
+    """
+    Get the IDs of movies or TV shows TMDB reports as changed in a date range.
 
-    # 组合 movies 和 tv_shows
-    trending_items = movies + tv_shows
+    Walks every page of /movie/changes or /tv/changes. Not cached: the feed is only read
+    by the scheduled watchlist notifier.
+
+    :param item_type: 'movie' or 'tv'
+    :param start_date: First day of the range (TMDB allows at most 14 days)
+    :param end_date: Last day of the range
+    :return: Set of TMDB IDs
+    """
+    params = {"start_date": start_date.isoformat(), "end_date": end_date.isoformat(), "page": 1}
+    changed: Set[int] = set()
+    while True:
+        data = await get_client().get(f"/{item_type}/changes", params=params)
+        changed.update(item['id'] for item in data.get('results', []) if not item.get('adult'))
+        if params["page"] >= data.get('total_pages', 1):
+            return changed
+        params["page"] += 1
 
-    # 添加 item_type 字段以便区分是电影还是电视剧
-    for item in trending_items:
-        if 'title' in item:
-            item['item_type'] = 'movie'
-        elif 'name' in item:
-            item['item_type'] = 'tv'
 
-    return trending_items
\ No newline at end of file
+def peek_details(item_type: str, item_id: int) -> Optional[Union[Movie, TVShow]]:
+    """
+    Get movie or TV show details only if they are already in the in-memory cache.
+
+    :param item_type: 'movie' or 'tv'
+    :param item_id: TMDB ID
+    :return: Cached details, or None without contacting TMDB
+    """
+    if item_type == 'movie':
+        return response_cache.peek(_cache_key("details", f"/movie/{item_id}", MOVIE_DETAILS_PARAMS))
+    return response_cache.peek(_cache_key("details", f"/tv/{item_id}", TV_DETAILS_PARAMS))
+
+
+async def prefetch_details(items: List[Tuple[str, int]]) -> None:
+    """
+    Load the details of items the user is likely to open next into the response cache.
+
+    Requests run in the background priority lane, so they never delay interactive ones.
+    Cancelling the call abandons requests no one else is waiting for.
+
+    :param items: (item_type, item_id) pairs, 'movie' or 'tv'
+    """
+    with use_priority(Priority.BACKGROUND):
+        await asyncio.gather(*(get_movie_details(item_id) if item_type == 'movie' else get_tv_show_details(item_id)
+                               for item_type, item_id in items if peek_details(item_type, item_id) is None),
+                             return_exceptions=True)
@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from config import TMDB_IMAGE_BASE_URL, TMDB_TIMEOUT, POSTER_CACHE_DIR, POSTER_CACHE_MAX_BYTES
+from services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# TMDB 图片 CDN 提供的海报尺寸
+POSTER_SIZES = ('w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original')
+
+
+@dataclass
+class PosterCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_fetched: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+class PosterCache:
+    """
+    Size-bounded on-disk cache of poster images.
+
+    Each (size, poster_path) variant is downloaded from TMDB's image CDN once and stored in
+    a file named after the SHA-256 of its key. When the total size exceeds max_bytes the
+    least recently used files are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, image_base_url: str = TMDB_IMAGE_BASE_URL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.image_base_url = image_base_url
+        self.stats = PosterCacheStats()
+        self._files: "OrderedDict[str, int]" = OrderedDict()  # file name -> size, LRU order
+        self._total_bytes = 0
+        self._downloads = SingleFlight()
+        self._client: Optional[httpx.AsyncClient] = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._total_bytes += size
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.image_base_url, timeout=TMDB_TIMEOUT)
+        return self._client
+
+    @staticmethod
+    def _file_name(poster_path: str, size: str) -> str:
+        return hashlib.sha256(f"{size}{poster_path}".encode()).hexdigest() + os.path.splitext(poster_path)[1]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(name))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name: str, data: bytes) -> None:
+        tmp_path = self._path(name) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(name))
+
+    def _evict(self) -> List[str]:
+        """Drop least recently used entries until the cache fits; returns the files to delete."""
+        # 只在事件循环中修改 _files 和 _total_bytes，线程里只删除文件
+        victims = []
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            self.stats.evictions += 1
+            victims.append(name)
+        return victims
+
+    def _remove(self, names: List[str]) -> None:
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    async def _download(self, poster_path: str, size: str, name: str) -> bytes:
+        response = await self.http.get(f"/{size}{poster_path}")
+        response.raise_for_status()
+        data = response.content
+        self.stats.bytes_fetched += len(data)
+        await asyncio.to_thread(self._write, name, data)
+        self._total_bytes += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        victims = self._evict()
+        if victims:
+            await asyncio.to_thread(self._remove, victims)
+        return data
+
+    async def get(self, poster_path: str, size: str = 'w500') -> bytes:
+        """
+        Get the image bytes of a poster, downloading it on a cache miss.
+
+        :param poster_path: TMDB poster path
+        :param size: One of POSTER_SIZES
+        :return: Image bytes
+        """
+        if size not in POSTER_SIZES:
+            raise ValueError(f"Unknown poster size: {size}")
+        name = self._file_name(poster_path, size)
+        if name in self._files:
+            data = await asyncio.to_thread(self._read, name)
+            if data is not None:
+                self.stats.hits += 1
+                self._files.move_to_end(name)
+                return data
+            # 读取期间条目可能已被淘汰
+            self._total_bytes -= self._files.pop(name, 0)
+        self.stats.misses += 1
+        return await self._downloads.do(name, lambda: self._download(poster_path, size, name))
+
+    async def prefetch(self, poster_paths: Iterable[Optional[str]], sizes: Iterable[str] = ('w500',),
+                       concurrency: int = 4) -> int:
+        """
+        Download posters into the cache ahead of time.
+
+        :param poster_paths: TMDB poster paths; empty values are skipped
+        :param sizes: Variants to fetch for every poster
+        :param concurrency: Maximum parallel downloads
+        :return: Number of variants now available in the cache
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(poster_path: str, size: str) -> bool:
+            async with semaphore:
+                try:
+                    await self.get(poster_path, size)
+                    return True
+                except (httpx.HTTPError, OSError) as e:
+                    logger.warning("Failed to prefetch poster %s (%s): %s", poster_path, size, e)
+                    return False
+
+        results = await asyncio.gather(*(fetch(path, size) for path in set(filter(None, poster_paths))
+                                         for size in sizes))
+        return sum(results)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# 首次使用时才创建，导入模块不会建目录或扫描磁盘
+_poster_cache: Optional[PosterCache] = None
+
+
+def get_poster_cache() -> Optional[PosterCache]:
+    """Return the process-wide poster cache, or None if POSTER_CACHE_DIR is empty."""
+    global _poster_cache
+    if _poster_cache is None and POSTER_CACHE_DIR:
+        _poster_cache = PosterCache(POSTER_CACHE_DIR, POSTER_CACHE_MAX_BYTES)
+    return _poster_cache
+
+
+async def close_poster_cache() -> None:
+    """Close the process-wide poster cache, if one was created."""
+    global _poster_cache
+    if _poster_cache is not None:
+        await _poster_cache.aclose()
+        _poster_cache = None
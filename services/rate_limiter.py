@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, Iterator, Optional
+
+
+class Priority(IntEnum):
+    """Request lanes; lower values are served first."""
+    INTERACTIVE = 0  # search, item details and other user-facing lookups
+    BACKGROUND = 1  # trending refreshes, prefetching, notifications
+
+
+# 当前请求所属的优先级，后台任务通过 use_priority 切换到 BACKGROUND
+current_priority: ContextVar[Priority] = ContextVar("current_priority", default=Priority.INTERACTIVE)
+
+
+@contextlib.contextmanager
+def use_priority(priority: Priority) -> Iterator[None]:
+    """Run the enclosed TMDB calls (and tasks spawned from them) in the given lane."""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+@dataclass
+class LaneStats:
+    acquired: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+@dataclass
+class RateLimiterStats:
+    throttled: int = 0  # 429 responses reported by the client
+    lanes: Dict[Priority, LaneStats] = field(default_factory=lambda: {p: LaneStats() for p in Priority})
+
+
+class RateLimiter:
+    """
+    Token bucket with priority lanes and adaptive (AIMD) rate control.
+
+    Waiters are granted tokens strictly by lane, so interactive requests overtake queued
+    background ones. A 429 halves the rate and pauses the bucket for Retry-After seconds;
+    every success slowly raises the rate back towards the configured maximum.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 1.0, increase_step: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.burst = burst
+        self.stats = RateLimiterStats()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lanes: Dict[Priority, Deque[asyncio.Future]] = {p: deque() for p in Priority}
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float) -> None:
+        if now > self._paused_until:
+            start = max(self._updated, self._paused_until)
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = now
+
+    def _has_waiters(self) -> bool:
+        return any(self._lanes.values())
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Number of waiters per lane."""
+        return {p.name.lower(): len(q) for p, q in self._lanes.items()}
+
+    async def acquire(self, priority: Optional[Priority] = None) -> float:
+        """
+        Wait for a token.
+
+        :param priority: Lane to queue in; defaults to the current context's priority
+        :return: Seconds spent waiting
+        """
+        priority = current_priority.get() if priority is None else priority
+        start = time.monotonic()
+        self._refill(start)
+        if not self._has_waiters() and start >= self._paused_until and self._tokens >= 1:
+            self._tokens -= 1
+            self.stats.lanes[priority].record(0.0)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self._lanes[priority]:
+                self._lanes[priority].remove(future)
+            elif future.done() and not future.cancelled():
+                self._tokens += 1  # Token was granted after we gave up; hand it back
+            raise
+        wait = time.monotonic() - start
+        self.stats.lanes[priority].record(wait)
+        return wait
+
+    async def _dispatch(self) -> None:
+        while self._has_waiters():
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            while self._tokens >= 1 and self._has_waiters():
+                lane = next(q for q in self._lanes.values() if q)
+                future = lane.popleft()
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
+            if self._has_waiters():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        """Additive increase after a successful response."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """
+        Multiplicative decrease after a 429 response.
+
+        :param retry_after: Seconds from the Retry-After header, if present
+        """
+        self.stats.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, now + (retry_after if retry_after else 1.0 / self.rate))
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current rate, queue depth and per-lane wait-time metrics."""
+        return {
+            "rate": self.rate,
+            "throttled": self.stats.throttled,
+            "queue_depth": self.queue_depth(),
+            "lanes": {
+                p.name.lower(): {
+                    "acquired": s.acquired,
+                    "avg_wait": s.total_wait / s.acquired if s.acquired else 0.0,
+                    "max_wait": s.max_wait,
+                }
+                for p, s in self.stats.lanes.items()
+            },
+        }
@@ -0,0 +1,88 @@
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services.rate_limiter import Priority, current_priority
+
+
+@dataclass
+class SingleFlightStats:
+    """Counters describing how many calls were coalesced."""
+    calls: int = 0
+    executions: int = 0
+    shared: int = 0
+    abandoned: int = 0
+    overtaken: int = 0  # Calls that started their own execution instead of joining a lower-priority one
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one upstream execution.
+
+    The first caller for a key starts the work in its own task; callers arriving while it
+    is in flight await the same task and receive the same result or exception. The task is
+    shielded so a cancelled caller does not cancel the work for everyone else; only when
+    every caller has been cancelled is the work itself cancelled.
+
+    A caller does not join work started at a lower priority (e.g. an interactive lookup
+    arriving while a background prefetch of the same key is queued in the rate limiter's
+    background lane): it starts its own execution in its own lane, which later callers join.
+    """
+
+    def __init__(self):
+        self.stats = SingleFlightStats()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._priorities: Dict[asyncio.Task, Priority] = {}
+
+    def in_flight(self) -> int:
+        """Number of keys currently being fetched."""
+        return len(self._inflight)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        self._priorities.pop(task, None)
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn for key, or join an identical call already in flight.
+
+        :param key: Identity of the call, e.g. endpoint and parameters
+        :param fn: Coroutine factory performing the work
+        :return: Result of the shared execution
+        """
+        self.stats.calls += 1
+        priority = current_priority.get()
+        task = self._inflight.get(key)
+        if task is not None and priority < self._priorities[task]:
+            # 加入后台发起的请求会让交互请求排在后台队列中，
+            # 改为按自己的优先级重新请求
+            self.stats.overtaken += 1
+            task = None
+        if task is None:
+            self.stats.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._priorities[task] = priority
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.stats.shared += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # 没有其他调用方在等待结果，放弃这次请求
+                self.stats.abandoned += 1
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
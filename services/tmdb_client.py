@@ -0,0 +1,193 @@
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import TMDB_API_KEY, TMDB_BASE_URL, TMDB_TIMEOUT, TMDB_CONNECT_TIMEOUT, TMDB_MAX_CONNECTIONS, \
+    TMDB_MAX_KEEPALIVE_CONNECTIONS, TMDB_RATE_LIMIT, TMDB_RATE_BURST, TMDB_MIN_RATE_LIMIT, TMDB_MAX_RETRIES, \
+    METRICS_ENABLED, TMDB_BREAKER_FAILURE_THRESHOLD, TMDB_BREAKER_RESET_TIMEOUT, TMDB_BREAKER_HALF_OPEN_CALLS
+from services.circuit_breaker import CircuitBreaker
+from services.metrics import TMDB_LATENCY, TMDB_RESPONSES, TMDB_RETRIES, endpoint_label
+from services.models import loads
+from services.rate_limiter import Priority, RateLimiter
+
+try:
+    import h2  # noqa: F401  # installed with httpx[http2] from requirements.txt
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date.
+
+    :param value: Raw header value
+    :return: Delay in seconds, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TMDBClient:
+    """Async TMDB API client sharing one keep-alive connection pool."""
+
+    def __init__(self, base_url: str = TMDB_BASE_URL, api_key: Optional[str] = TMDB_API_KEY,
+                 timeout: float = TMDB_TIMEOUT, connect_timeout: float = TMDB_CONNECT_TIMEOUT,
+                 max_connections: int = TMDB_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = TMDB_MAX_KEEPALIVE_CONNECTIONS,
+                 rate_limiter: Optional[RateLimiter] = None, max_retries: int = TMDB_MAX_RETRIES,
+                 breaker_failure_threshold: int = TMDB_BREAKER_FAILURE_THRESHOLD,
+                 breaker_reset_timeout: float = TMDB_BREAKER_RESET_TIMEOUT,
+                 breaker_half_open_calls: int = TMDB_BREAKER_HALF_OPEN_CALLS):
+        self.base_url = base_url
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "accept": "application/json"
+        }
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections)
+        self.rate_limiter = rate_limiter or RateLimiter(TMDB_RATE_LIMIT, TMDB_RATE_BURST, TMDB_MIN_RATE_LIMIT)
+        self.max_retries = max_retries
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.breaker_half_open_calls = breaker_half_open_calls
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """The underlying pooled httpx client, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=HTTP2_AVAILABLE,
+            )
+        return self._client
+
+    async def get(self, path: str, params: Optional[Dict[str, Any]] = None,
+                  timeout: Optional[float] = None, priority: Optional[Priority] = None) -> Dict[str, Any]:
+        """
+        Perform a rate-limited GET request against the TMDB API.
+
+        429 responses are retried up to max_retries times after the delay given by
+        Retry-After; the rate limiter backs off at the same time. Each endpoint has a
+        circuit breaker: while it is open, requests fail fast with CircuitOpenError
+        instead of waiting for TMDB to time out.
+
+        :param path: API path relative to the base URL, e.g. '/movie/550'
+        :param params: Query parameters
+        :param timeout: Per-request timeout in seconds, overriding the client default
+        :param priority: Rate limiter lane; defaults to the current context's priority
+        :return: Decoded JSON response
+        :raises CircuitOpenError: If the endpoint's circuit is open
+        """
+        endpoint = endpoint_label(path)
+        breaker = self.breaker(endpoint)
+        probe = breaker.acquire()
+        start = time.perf_counter()
+        try:
+            data = await self._get(path, params, timeout, priority, endpoint if METRICS_ENABLED else None)
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if METRICS_ENABLED:
+                TMDB_RESPONSES.inc(endpoint, str(status))
+            # 4xx 说明 TMDB 本身工作正常，只有 5xx 和重试耗尽的 429 算作故障
+            if status >= 500 or status == 429:
+                breaker.record_failure(probe)
+            else:
+                breaker.record_success(probe)
+            raise
+        except httpx.HTTPError:
+            if METRICS_ENABLED:
+                TMDB_RESPONSES.inc(endpoint, 'error')
+            breaker.record_failure(probe)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+        finally:
+            if METRICS_ENABLED:
+                TMDB_LATENCY.observe(time.perf_counter() - start, endpoint)
+        breaker.record_success(probe)
+        return data
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """The circuit breaker of an endpoint label, e.g. '/movie/{id}'."""
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                endpoint, self.breaker_failure_threshold, self.breaker_reset_timeout, self.breaker_half_open_calls)
+        return breaker
+
+    def allows_request(self, path: str) -> bool:
+        """Whether a request to path would currently reach TMDB rather than fail fast."""
+        breaker = self.breakers.get(endpoint_label(path))
+        return breaker is None or breaker.allows_request()
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]], timeout: Optional[float],
+                   priority: Optional[Priority], endpoint: Optional[str] = None) -> Dict[str, Any]:
+        kwargs = {"params": params}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(priority)
+            response = await self.http.get(path, **kwargs)
+            if response.status_code == 429 and attempt < self.max_retries:
+                if endpoint is not None:
+                    TMDB_RETRIES.inc(endpoint)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logger.warning("TMDB rate limited %s, retrying after %ss", path, retry_after)
+                self.rate_limiter.on_rate_limited(retry_after)
+                continue
+            if response.status_code == 429:
+                self.rate_limiter.on_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+            else:
+                self.rate_limiter.on_success()
+            response.raise_for_status()
+            if endpoint is not None:
+                TMDB_RESPONSES.inc(endpoint, str(response.status_code))
+            return loads(response.content)
+
+    async def aclose(self) -> None:
+        """Close the connection pool."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_client: Optional[TMDBClient] = None
+
+
+def get_client() -> TMDBClient:
+    """Return the process-wide TMDB client."""
+    global _client
+    if _client is None:
+        _client = TMDBClient()
+    return _client
+
+
+async def close_client() -> None:
+    """Close the process-wide TMDB client, if one was created."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None